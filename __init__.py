@@ -12,7 +12,19 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 import importlib
 if "bpy" in locals():
+    # the modules are reloaded after the ones they import
+    importlib.reload(profiling)
+    importlib.reload(budget)
+    importlib.reload(objio)
     importlib.reload(utils)
+    importlib.reload(incremental)
+    importlib.reload(geocache)
+    importlib.reload(journal)
+    importlib.reload(decaltrim)
+    importlib.reload(decalmat)
+    if "pool" in locals():
+        # only imported by the command line
+        importlib.reload(pool)
     importlib.reload(props)
     importlib.reload(ops)
     importlib.reload(ui)
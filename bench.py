@@ -0,0 +1,354 @@
+"""Benchmark suite for the batch pipelines
+
+Generates synthetic inputs, runs every pipeline in its own background
+Blender through cli.py with profiling enabled and collects throughput,
+per item latency and peak memory into a results file:
+
+    blender -b -P kitops-batch/bench.py -- --inserts 20 --objs 20 --pngs 20
+    blender -b -P kitops-batch/bench.py -- --baseline bench_baseline.json --save-baseline
+    blender -b -P kitops-batch/bench.py -- --baseline bench_baseline.json
+
+When a baseline is given the results are compared with it and any pipeline
+that got slower or used more memory than the tolerance is reported as a
+regression, the exit code is then 1.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import bpy
+
+PIPELINES = ("thumbs", "obj-to-blend", "blend-to-obj", "decals", "export-blend")
+
+# pipelines creating KIT OPS INSERTS can't run without KIT OPS
+KITOPS_PIPELINES = ("thumbs", "decals")
+
+
+def get_addon_name():
+    """Get the addon module name from the addon folder name"""
+    if __package__:
+        return __package__
+    return os.path.basename(os.path.dirname(os.path.realpath(__file__)))
+
+
+def int_list(text):
+    """Parse a comma separated list of integers"""
+    return [int(value) for value in text.split(",") if value]
+
+
+def build_parser():
+    """Create the argument parser of the benchmark"""
+    parser = argparse.ArgumentParser(
+        prog= "blender -b -P bench.py --",
+        description= "Benchmark the KIT OPS BATCH pipelines on synthetic inputs"
+    )
+    parser.add_argument("--pipelines", default= ",".join(PIPELINES), help= "Comma separated pipelines to run")
+    parser.add_argument("--data-dir", default= "", help= "Folder for the generated inputs, a temporary folder by default")
+    parser.add_argument("--seed", type= int, default= 0)
+    parser.add_argument("--inserts", type= int, default= 10, help= "Number of INSERT blends")
+    parser.add_argument("--insert-polys", type= int, default= 2000, help= "Polygons per INSERT")
+    parser.add_argument("--render-samples", type= int, default= 4, help= "Maximum samples of the thumbnails")
+    parser.add_argument("--objs", type= int, default= 10, help= "Number of OBJ files")
+    parser.add_argument("--obj-faces", type= int_list, default= [1000, 10000, 50000], help= "Face counts cycled over the OBJ files")
+    parser.add_argument("--obj-texture", type= int, default= 256, help= "Size of the OBJ MTL textures")
+    parser.add_argument("--scene-objects", type= int, default= 20, help= "Objects in the blend scene for blend to OBJ and blend export")
+    parser.add_argument("--pngs", type= int, default= 10, help= "Number of decal PNGs")
+    parser.add_argument("--png-sizes", type= int_list, default= [64, 512, 2048], help= "Resolutions cycled over the PNGs")
+    parser.add_argument("--workers", type= int, default= 1, help= "Workers passed to the pipelines supporting them")
+    parser.add_argument("--output", default= "bench_results.json", help= "Results file")
+    parser.add_argument("--baseline", default= "", help= "Baseline results file to compare with")
+    parser.add_argument("--save-baseline", action= "store_true", help= "Write the results as the new baseline")
+    parser.add_argument("--tolerance", type= float, default= 0.15, help= "Allowed relative regression")
+    return parser
+
+
+# ____________________________________________________
+# synthetic inputs
+
+def write_png(path, width, height, margin= 0.2, seed= 0):
+    """Write an RGBA PNG with a transparent margin around an opaque shape"""
+    rng = random.Random(seed)
+    color = bytes(rng.randrange(256) for i in range(3))
+    x0, x1 = int(width * margin), int(width * (1 - margin))
+    y0, y1 = int(height * margin), int(height * (1 - margin))
+
+    transparent = b"\0\0\0\0"
+    opaque = color + b"\xff"
+    inside = transparent * x0 + opaque * (x1 - x0) + transparent * (width - x1)
+    outside = transparent * width
+    rows = b"".join(b"\0" + (inside if y0 <= y < y1 else outside) for y in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(path, 'wb') as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        png.write(chunk(b"IDAT", zlib.compress(rows, 6)))
+        png.write(chunk(b"IEND", b""))
+
+
+def grid(faces, seed= 0):
+    """Get the vertices and quads of a wavy grid with about the given face count"""
+    side = max(1, int(math.ceil(math.sqrt(faces))))
+    rng = random.Random(seed)
+    phase = rng.uniform(0, math.pi)
+    verts = []
+    for j in range(side + 1):
+        for i in range(side + 1):
+            x, y = i / side - 0.5, j / side - 0.5
+            verts.append((x, y, 0.05 * math.sin(8 * x + phase) * math.cos(8 * y)))
+    quads = []
+    for j in range(side):
+        for i in range(side):
+            a = j * (side + 1) + i
+            quads.append((a, a + 1, a + side + 2, a + side + 1))
+    return verts, quads, side
+
+
+def write_obj(folder, name, faces, texture_size, seed= 0):
+    """Write an OBJ with UVs, normals and a textured MTL material"""
+    verts, quads, side = grid(faces, seed)
+    texture = name + ".png"
+    write_png(os.path.join(folder, texture), texture_size, texture_size, margin= 0.0, seed= seed)
+
+    with open(os.path.join(folder, name + ".mtl"), 'w') as mtl:
+        mtl.write(f"newmtl {name}\nKd 0.8 0.8 0.8\nmap_Kd {texture}\n")
+
+    with open(os.path.join(folder, name + ".obj"), 'w') as obj:
+        obj.write(f"mtllib {name}.mtl\no {name}\n")
+        obj.write("".join(f"v {x:.6f} {y:.6f} {z:.6f}\n" for x, y, z in verts))
+        obj.write("".join(f"vt {x + 0.5:.6f} {y + 0.5:.6f}\n" for x, y, z in verts))
+        obj.write("vn 0 0 1\n")
+        obj.write(f"usemtl {name}\ns 1\n")
+        obj.write("".join("f {0}/{0}/1 {1}/{1}/1 {2}/{2}/1 {3}/{3}/1\n".format(*(i + 1 for i in quad)) for quad in quads))
+
+
+def new_grid_object(name, faces, seed= 0):
+    """Create a grid mesh object that isn't linked to any scene"""
+    verts, quads, side = grid(faces, seed)
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts, [], quads)
+    mesh.update()
+    return bpy.data.objects.new(name, mesh)
+
+
+def write_inserts(folder, count, faces, seed= 0):
+    """Write INSERT blends with one grid object each"""
+    for i in range(count):
+        name = f"insert_{i:04d}"
+        ob = new_grid_object(name, faces, seed + i)
+        bpy.data.libraries.write(os.path.join(folder, name + ".blend"), {ob})
+        mesh = ob.data
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(mesh)
+
+
+def write_scene_blend(path, count, faces, seed= 0):
+    """Write a blend file with one scene holding count grid objects"""
+    scene = bpy.data.scenes.new("Bench")
+    objects = []
+    for i in range(count):
+        ob = new_grid_object(f"object_{i:04d}", faces, seed + i)
+        ob.location = (i * 1.5, 0.0, 0.0)
+        scene.collection.objects.link(ob)
+        objects.append(ob)
+
+    bpy.data.libraries.write(path, {scene})
+
+    for ob in objects:
+        mesh = ob.data
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(mesh)
+    bpy.data.scenes.remove(scene)
+
+
+def generate(args, data_dir):
+    """Generate the inputs of the selected pipelines, returns the folders"""
+    folders = {name: os.path.join(data_dir, name.replace("-", "_")) for name in PIPELINES}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok= True)
+
+    pipelines = args.pipelines.split(",")
+    if "thumbs" in pipelines:
+        write_inserts(folders["thumbs"], args.inserts, args.insert_polys, args.seed)
+    if "obj-to-blend" in pipelines:
+        for i in range(args.objs):
+            faces = args.obj_faces[i % len(args.obj_faces)]
+            write_obj(folders["obj-to-blend"], f"obj_{i:04d}", faces, args.obj_texture, args.seed + i)
+    if "decals" in pipelines:
+        for i in range(args.pngs):
+            size = args.png_sizes[i % len(args.png_sizes)]
+            write_png(os.path.join(folders["decals"], f"decal_{i:04d}.png"), size, size, seed= args.seed + i)
+    for name in ("blend-to-obj", "export-blend"):
+        if name in pipelines:
+            write_scene_blend(os.path.join(folders[name], "scene.blend"), args.scene_objects, args.insert_polys, args.seed)
+    return folders
+
+
+# ____________________________________________________
+# running the pipelines
+
+def pipeline_command(args, name, folder):
+    """Get the blend file and cli.py arguments running a pipeline"""
+    if name == "thumbs":
+        # keep the benchmark about the pipeline, not about the render quality
+        return None, ["thumbs", "--kpack-folder", folder, "--workers", str(args.workers),
+            "--budget", "--budget-max-samples", str(args.render_samples), "--no-budget-denoise"]
+    elif name == "obj-to-blend":
+        return None, ["obj-to-blend", "--obj-folder", folder, "--no-create-insert", "--workers", str(args.workers)]
+    elif name == "blend-to-obj":
+        return os.path.join(folder, "scene.blend"), ["blend-to-obj", "--convert-mode", "objects"]
+    elif name == "decals":
+        return None, ["decals", "--images-folder", folder, "--workers", str(args.workers)]
+    else:
+        return os.path.join(folder, "scene.blend"), ["export-blend", "--no-create-insert"]
+
+
+def find_report(folder):
+    """Get the newest profiling report written under a folder"""
+    reports = []
+    for root, dirs, files in os.walk(folder):
+        reports += [os.path.join(root, f) for f in files if f.endswith(".profile.json")]
+    return max(reports, key= os.path.getmtime) if reports else None
+
+
+def run_pipeline(args, name, folder):
+    """Run a pipeline in a background Blender and read its profiling report"""
+    from .profiling import percentile
+
+    # a report left by a previous run in the same data folder
+    report_path = find_report(folder)
+    while report_path:
+        os.remove(report_path)
+        report_path = find_report(folder)
+
+    blend_file, command_args = pipeline_command(args, name, folder)
+    cmd = [bpy.app.binary_path, "-b"]
+    if blend_file:
+        cmd.append(blend_file)
+    cmd += ["-P", os.path.join(os.path.dirname(os.path.realpath(__file__)), "cli.py"), "--"]
+    cmd += command_args + ["--profile"]
+
+    start = time.perf_counter()
+    process = subprocess.run(cmd, stdout= subprocess.PIPE, stderr= subprocess.STDOUT, universal_newlines= True)
+    wall_time = time.perf_counter() - start
+
+    result = {"returncode": process.returncode, "wall_time": wall_time}
+    report_path = find_report(folder)
+    if process.returncode != 0 or not report_path:
+        print(process.stdout[-4000:])
+        return result
+
+    with open(report_path) as report_file:
+        report = json.load(report_file)
+    latencies = [entry["seconds"] for entry in report["items"] if "seconds" in entry]
+    if not latencies:
+        # items without their own time, the stage self times add up to it
+        latencies = [sum(entry["stages"].values()) for entry in report["items"]]
+
+    items = len(report["items"])
+    result.update({
+        "items": items,
+        "pipeline_time": report["wall_time"],
+        "throughput": items / report["wall_time"] if report["wall_time"] else 0.0,
+        "peak_memory": report["peak_memory"],
+        "stages": report["stages"],
+    })
+    if latencies:
+        result["latency"] = {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies),
+        }
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Get the list of regressions of the results against the baseline"""
+    regressions = []
+    for name, result in results["pipelines"].items():
+        base = baseline.get("pipelines", {}).get(name)
+        if not base or "throughput" not in base:
+            continue
+        if "throughput" not in result:
+            regressions.append(f"{name}: failed with code {result['returncode']}")
+            continue
+
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']:.2f}/s, baseline {base['throughput']:.2f}/s")
+        if "latency" in result and "latency" in base and result["latency"]["p95"] > base["latency"]["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency {result['latency']['p95']:.3f}s, baseline {base['latency']['p95']:.3f}s")
+        if result.get("peak_memory") and base.get("peak_memory") and result["peak_memory"] > base["peak_memory"] * (1 + tolerance):
+            regressions.append(f"{name}: peak memory {result['peak_memory'] / 2**20:.1f} MB, baseline {base['peak_memory'] / 2**20:.1f} MB")
+    return regressions
+
+
+def main(argv= None):
+    """Generate the inputs, run the pipelines and compare with the baseline"""
+    from .cli import enable_addon, get_script_args
+
+    args = build_parser().parse_args(get_script_args(argv))
+    enable_addon()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix= "kob_bench_")
+    print(f"Generating inputs in {data_dir}")
+    folders = generate(args, data_dir)
+
+    has_kitops = hasattr(bpy.types.Object, "kitops")
+    results = {
+        "blender": bpy.app.version_string,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "options": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline")},
+        "pipelines": {},
+    }
+    for name in args.pipelines.split(","):
+        if name in KITOPS_PIPELINES and not has_kitops:
+            print(f"Skipping {name}, KIT OPS is not installed")
+            continue
+        print(f"Running {name}")
+        result = run_pipeline(args, name, folders[name])
+        results["pipelines"][name] = result
+        if "throughput" in result:
+            print(f"  {result['items']} items, {result['throughput']:.2f} items/s, wall time {result['wall_time']:.2f}s")
+        else:
+            print(f"  failed with code {result['returncode']}")
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent= 1)
+    print(f"Results written to {args.output}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent= 1)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    # executed as a script with -P, run the registered addon module instead
+    # so the relative imports of the addon work
+    addon_parent = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if addon_parent not in sys.path:
+        sys.path.append(addon_parent)
+    importlib.import_module(get_addon_name() + ".cli").enable_addon()
+    bench = importlib.import_module(get_addon_name() + ".bench")
+    sys.exit(bench.main())
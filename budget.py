@@ -0,0 +1,95 @@
+"""Render budget for batch thumbnails
+
+Caps the cost of every thumbnail render: sample count, adaptive sampling
+noise threshold, a per render time limit, denoising and a texture size
+limit through simplify. A cheaper draft engine can be used instead of the
+scene engine. The original settings are restored after the batch.
+"""
+import bpy
+
+
+def get_eevee_engine():
+    """Get the EEVEE engine identifier of this Blender version"""
+    if (4, 2, 0) <= bpy.app.version < (5, 0, 0):
+        return 'BLENDER_EEVEE_NEXT'
+    return 'BLENDER_EEVEE'
+
+
+def set_setting(owner, name, value, state):
+    """Set a setting if this Blender version has it and keep its original value"""
+    if not hasattr(owner, name):
+        return
+    key = (owner, name)
+    if key not in state:
+        state[key] = getattr(owner, name)
+    setattr(owner, name, value)
+
+
+def apply_render_budget(scene, props):
+    """Apply the render budget to the scene, returns the original settings"""
+    state = {}
+    render = scene.render
+
+    if props.budget_draft_engine == 'EEVEE':
+        set_setting(render, "engine", get_eevee_engine(), state)
+    elif props.budget_draft_engine == 'WORKBENCH':
+        set_setting(render, "engine", 'BLENDER_WORKBENCH', state)
+
+    if render.engine == 'CYCLES':
+        cycles = scene.cycles
+        set_setting(cycles, "samples", min(cycles.samples, props.budget_max_samples), state)
+        set_setting(cycles, "use_adaptive_sampling", True, state)
+        set_setting(cycles, "adaptive_threshold", props.budget_noise_threshold, state)
+        set_setting(cycles, "time_limit", props.budget_time_limit, state)
+        set_setting(cycles, "use_denoising", props.budget_denoise, state)
+        if props.budget_texture_limit != 'OFF':
+            set_setting(render, "use_simplify", True, state)
+            set_setting(cycles, "texture_limit_render", props.budget_texture_limit, state)
+
+    elif render.engine == get_eevee_engine():
+        eevee = scene.eevee
+        set_setting(eevee, "taa_render_samples", min(eevee.taa_render_samples, props.budget_max_samples), state)
+
+    return state
+
+
+def restore_render_settings(state):
+    """Restore the settings changed by apply_render_budget"""
+    # the engine goes back last, the engine settings are independent of it
+    for (owner, name), value in sorted(state.items(), key= lambda item: item[0][1] == "engine"):
+        setattr(owner, name, value)
+
+
+def get_render_settings(scene):
+    """Get the render settings used for a thumbnail, recorded in the journal"""
+    render = scene.render
+    settings = {
+        "engine": render.engine,
+        "resolution": [render.resolution_x, render.resolution_y, render.resolution_percentage],
+    }
+
+    if render.engine == 'CYCLES':
+        cycles = scene.cycles
+        for name in ("samples", "use_adaptive_sampling", "adaptive_threshold", "time_limit", "use_denoising"):
+            if hasattr(cycles, name):
+                settings[name] = getattr(cycles, name)
+        if render.use_simplify:
+            settings["texture_limit_render"] = cycles.texture_limit_render
+    elif render.engine == get_eevee_engine():
+        settings["samples"] = scene.eevee.taa_render_samples
+
+    return settings
+
+
+def get_budget_fingerprint(props):
+    """Get the budget options that change the rendered thumbnails"""
+    if not props.render_budget:
+        return None
+    return {
+        "max_samples": props.budget_max_samples,
+        "noise_threshold": round(props.budget_noise_threshold, 6),
+        "time_limit": round(props.budget_time_limit, 3),
+        "denoise": props.budget_denoise,
+        "texture_limit": props.budget_texture_limit,
+        "draft_engine": props.budget_draft_engine,
+    }
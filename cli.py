@@ -0,0 +1,442 @@
+"""Command line entry point for running KIT OPS BATCH without the UI
+
+Run one of the batch pipelines from a background Blender, for example:
+
+    blender -b render.blend -P kitops-batch/cli.py -- thumbs --kpack-folder /path/to/kpack
+    blender -b -P kitops-batch/cli.py -- obj-to-blend --obj-folder /path/to/objs
+    blender -b scene.blend -P kitops-batch/cli.py -- blend-to-obj --convert-mode collections
+    blender -b -P kitops-batch/cli.py -- decals --images-folder /path/to/pngs
+    blender -b scene.blend -P kitops-batch/cli.py -- export-blend
+
+or from an already running Blender with the addon enabled:
+
+    blender -b --python-expr "import importlib; importlib.import_module('kitops-batch.cli').main()" -- thumbs ...
+
+Thumbnails, OBJ to blend and decals can be split over several background
+Blender workers with --workers N, see pool.py.
+
+Every option mirrors a KOBProps property, the values are written to
+bpy.context.window_manager.kob before the matching operator is called.
+"""
+import argparse
+import importlib
+import math
+import os
+import sys
+import time
+
+import bpy
+
+AXES = ("X", "Y", "Z", "-X", "-Y", "-Z")
+
+# commands that can be split over several background workers
+SHARDED_COMMANDS = ("thumbs", "obj-to-blend", "decals")
+
+COMMANDS = {
+    "thumbs": "kob.batch_render_thumbs",
+    "obj-to-blend": "kob.batch_convert_blend",
+    "blend-to-obj": "kob.batch_convert_obj",
+    "decals": "kob.batch_convert_img",
+    "export-blend": "kob.batch_export_blend",
+}
+
+
+def get_addon_name():
+    """Get the addon module name from the addon folder name"""
+    if __package__:
+        return __package__
+    return os.path.basename(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_script_args(argv=None):
+    """Get the arguments passed to the script after '--'"""
+    if argv is None:
+        argv = sys.argv
+        if "--" in argv:
+            argv = argv[argv.index("--") + 1:]
+        else:
+            argv = []
+    return argv
+
+
+def add_bool_option(parser, name, default, help_text):
+    """Add a --name / --no-name pair of options"""
+    dest = name.replace("-", "_")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(f"--{name}", dest= dest, action= "store_true", help= help_text)
+    group.add_argument(f"--no-{name}", dest= dest, action= "store_false")
+    parser.set_defaults(**{dest: default})
+
+
+def add_worker_options(parser):
+    """Options to shard a folder over several background workers"""
+    parser.add_argument("--workers", type= int, default= 1, help= "Number of background Blender workers")
+    # set by the coordinator on the command line of each worker
+    parser.add_argument("--items-file", default= "", help= argparse.SUPPRESS)
+    parser.add_argument("--log-suffix", default= "", help= argparse.SUPPRESS)
+    parser.add_argument("--render-threads", type= int, default= 0, help= argparse.SUPPRESS)
+
+
+def add_insert_options(parser):
+    """Options shared by the pipelines creating KIT OPS INSERTS"""
+    add_bool_option(parser, "create-insert", True, "Create KIT OPS INSERT")
+    add_bool_option(parser, "center-n-set", True, "Center XY and set on ground")
+    add_bool_option(parser, "clear-split-normals", True, "Clear custom split normals")
+    parser.add_argument("--deduplicate", action= "store_true", help= "Skip the blends with the same geometry as an already written one")
+    parser.add_argument("--sharp-angle", type= float, default= None, help= "Mark edges above this angle in degrees as sharp after clearing the normals")
+
+
+def build_parser():
+    """Create the argument parser for all the batch commands"""
+    parser = argparse.ArgumentParser(
+        prog= "blender -b -P cli.py --",
+        description= "Run KIT OPS BATCH pipelines without the user interface"
+    )
+    commands = parser.add_subparsers(dest= "command", metavar= "command")
+    commands.required = True
+
+    thumbs = commands.add_parser("thumbs", help= "Batch render INSERT thumbnails")
+    thumbs.add_argument("--kpack-folder", required= True, help= "KPACK folder with the INSERT blends")
+    thumbs.add_argument("--render-blend", default= "", help= "Render scene, defaults to the opened file or the addon render.blend")
+    add_bool_option(thumbs, "auto-camera-pos", True, "Enable camera auto alignment to insert")
+    thumbs.add_argument("--camera-framing", choices= ("VIEW", "BOUNDS", "TIGHT"), default= "BOUNDS", help= "Camera fitting mode")
+    thumbs.add_argument("--camera-padding", type= float, default= None, help= "Camera padding (-1.0 to 1.0)")
+    thumbs.add_argument("--kitops-append", action= "store_true", help= "Append with the KIT OPS operator, needs a window")
+    thumbs.add_argument("--persistent-session", action= "store_true", help= "Keep the render scene loaded between thumbnails")
+    thumbs.add_argument("--budget", action= "store_true", help= "Cap the samples and render time of every thumbnail")
+    thumbs.add_argument("--budget-max-samples", type= int, default= 128)
+    thumbs.add_argument("--budget-noise-threshold", type= float, default= 0.05)
+    thumbs.add_argument("--budget-time-limit", type= float, default= 30.0, help= "Seconds, 0 for no limit")
+    add_bool_option(thumbs, "budget-denoise", True, "Denoise the thumbnails")
+    thumbs.add_argument("--budget-texture-limit", choices= ("OFF", "128", "256", "512", "1024", "2048", "4096"), default= "1024")
+    thumbs.add_argument("--budget-draft-engine", choices= ("NONE", "EEVEE", "WORKBENCH"), default= "NONE")
+    thumbs.add_argument("--incremental", action= "store_true", help= "Skip up-to-date thumbnails")
+    thumbs.add_argument("--resume", action= "store_true", help= "Resume the interrupted batch from its journal")
+    thumbs.add_argument("--max-crashes", type= int, default= 2, help= "Quarantine an INSERT after crashing this many times")
+    add_worker_options(thumbs)
+
+    obj_to_blend = commands.add_parser("obj-to-blend", help= "Batch convert OBJ files to .blend files")
+    obj_to_blend.add_argument("--obj-folder", required= True, help= "OBJ files folder")
+    add_insert_options(obj_to_blend)
+    add_worker_options(obj_to_blend)
+    obj_to_blend.add_argument("--override-material", default= "", help= "Name of a material in the opened file")
+    obj_to_blend.add_argument("--obj-reader", choices= ("BUILTIN", "BLENDER"), default= "BLENDER", help= "OBJ reader")
+    obj_to_blend.add_argument("--obj-lookahead", type= int, default= 2, help= "OBJ files parsed ahead by the built-in reader")
+    obj_to_blend.add_argument("--geometry-cache", action= "store_true", help= "Reuse the geometry parsed by earlier runs")
+    obj_to_blend.add_argument("--use-edges", action= "store_true", help= "Import lines")
+    obj_to_blend.add_argument("--use-smooth-groups", action= "store_true", help= "Import smooth groups")
+    obj_to_blend.add_argument("--use-split-objects", action= "store_true", help= "Split by object")
+    obj_to_blend.add_argument("--use-split-groups", action= "store_true", help= "Split by group")
+    obj_to_blend.add_argument("--use-groups-as-vgroups", action= "store_true", help= "Import poly groups")
+    obj_to_blend.add_argument("--use-image-search", action= "store_true", help= "Search for missing images")
+    obj_to_blend.add_argument("--split-mode", choices= ("ON", "OFF"), default= "ON")
+    obj_to_blend.add_argument("--clamp-size", type= float, default= 0.0, help= "Clamp size")
+    obj_to_blend.add_argument("--axis-forward", choices= AXES, default= "Z")
+    obj_to_blend.add_argument("--axis-up", choices= AXES, default= "X")
+
+    blend_to_obj = commands.add_parser("blend-to-obj", help= "Export scene objects or collections to OBJ files")
+    blend_to_obj.add_argument("--convert-mode", choices= ("collections", "objects"), default= "objects")
+    blend_to_obj.add_argument("--obj-writer", choices= ("BUILTIN", "BLENDER"), default= "BLENDER", help= "OBJ writer")
+    blend_to_obj.add_argument("--obj-write-threads", type= int, default= 2, help= "Threads writing the OBJ files, 0 for none")
+
+    decals = commands.add_parser("decals", help= "Batch convert PNG images to decal INSERTS")
+    decals.add_argument("--images-folder", required= True, help= "Transparent PNG images folder")
+    decals.add_argument("--decal-temp-file", default= "", help= "Decals template file")
+    decals.add_argument("--decal-material", choices= ("COPY", "SHARED"), default= "COPY", help= "Copy the template material or share a node group")
+    decals.add_argument("--trim", choices= ("NONE", "UV", "CROP"), default= "NONE", help= "Trim the transparent margins")
+    decals.add_argument("--cutout", action= "store_true", help= "Shape the trimmed decals after the opaque pixels")
+    decals.add_argument("--alpha-threshold", type= float, default= 0.01, help= "Alpha below which pixels are trimmed")
+    decals.add_argument("--adaptive-subdiv", action= "store_true", help= "Choose the subdivision levels from the decal size")
+    decals.add_argument("--max-subdiv", type= int, default= 3, help= "Subdivision levels of the largest decals")
+    decals.add_argument("--subdiv-edge", type= float, default= 0.064, help= "Subdivided face length in meters")
+    decals.add_argument("--bake-modifiers", action= "store_true", help= "Apply the modifiers before the shrinkwrap")
+    add_worker_options(decals)
+
+    export_blend = commands.add_parser("export-blend", help= "Export scene objects to external blend files")
+    add_insert_options(export_blend)
+
+    for command in commands.choices.values():
+        command.add_argument("--profile", action= "store_true", help= "Time every stage and write a report next to the log file")
+
+    return parser
+
+
+def enable_addon():
+    """Make sure the addon is registered"""
+    if not hasattr(bpy.context.window_manager, "kob"):
+        import addon_utils
+        addon_utils.enable(get_addon_name(), default_set= True)
+    return hasattr(bpy.context.window_manager, "kob")
+
+
+def apply_args(props, args):
+    """Copy the command line options to the addon properties"""
+    from . import utils
+    utils.get_prefs().profile_stages = args.profile
+
+    if args.command == "thumbs":
+        props.kpack_folder = os.path.abspath(args.kpack_folder)
+        props.auto_camera_pos = args.auto_camera_pos
+        props.camera_framing = args.camera_framing
+        props.fast_append = not args.kitops_append
+        props.persistent_session = args.persistent_session
+        props.render_budget = args.budget
+        props.budget_max_samples = args.budget_max_samples
+        props.budget_noise_threshold = args.budget_noise_threshold
+        props.budget_time_limit = args.budget_time_limit
+        props.budget_denoise = args.budget_denoise
+        props.budget_texture_limit = args.budget_texture_limit
+        props.budget_draft_engine = args.budget_draft_engine
+        props.incremental_render = args.incremental
+        props.resume_render = args.resume
+        props.max_crashes = max(1, args.max_crashes)
+        if args.camera_padding is not None:
+            # write the raw value, the property setter moves the camera
+            props["camera_padding"] = max(-1.0, min(1.0, args.camera_padding))
+
+    elif args.command == "obj-to-blend":
+        props.obj_folder = os.path.abspath(args.obj_folder)
+        props.create_insert = args.create_insert
+        props.center_n_set = args.center_n_set
+        props.clear_split_normals = args.clear_split_normals
+        props.deduplicate = args.deduplicate
+        props.sharp_by_angle = args.sharp_angle is not None
+        if args.sharp_angle is not None:
+            props.sharp_angle = math.radians(args.sharp_angle)
+        props.obj_reader = args.obj_reader
+        props.obj_lookahead = args.obj_lookahead
+        props.geometry_cache = args.geometry_cache
+        props.use_edges = args.use_edges
+        props.use_smooth_groups = args.use_smooth_groups
+        props.use_split_objects = args.use_split_objects
+        props.use_split_groups = args.use_split_groups
+        props.use_groups_as_vgroups = args.use_groups_as_vgroups
+        props.use_image_search = args.use_image_search
+        props.split_mode = args.split_mode
+        props.global_clight_size = args.clamp_size
+        props.axis_forward = args.axis_forward
+        props.axis_up = args.axis_up
+        if args.override_material:
+            material = bpy.data.materials.get(args.override_material)
+            if material is None:
+                raise ValueError(f"Material {args.override_material} not found")
+            props.override_material = material
+
+    elif args.command == "blend-to-obj":
+        props.convert_mode = '0' if args.convert_mode == "collections" else '1'
+        props.obj_writer = args.obj_writer
+        props.obj_write_threads = args.obj_write_threads
+
+    elif args.command == "decals":
+        props.images_folder = os.path.abspath(args.images_folder)
+        if args.decal_temp_file:
+            props.decal_temp_file = os.path.abspath(args.decal_temp_file)
+        props.decal_material = args.decal_material
+        props.decal_trim = args.trim
+        props.decal_cutout = args.cutout
+        props.decal_alpha_threshold = args.alpha_threshold
+        props.decal_adaptive_subdiv = args.adaptive_subdiv
+        props.decal_max_subdiv = args.max_subdiv
+        props.decal_subdiv_edge = args.subdiv_edge
+        props.decal_bake_modifiers = args.bake_modifiers
+
+    elif args.command == "export-blend":
+        props.create_insert = args.create_insert
+        props.center_n_set = args.center_n_set
+        props.clear_split_normals = args.clear_split_normals
+        props.deduplicate = args.deduplicate
+        props.sharp_by_angle = args.sharp_angle is not None
+        if args.sharp_angle is not None:
+            props.sharp_angle = math.radians(args.sharp_angle)
+
+    if args.command in SHARDED_COMMANDS:
+        props.log_suffix = args.log_suffix
+        if args.render_threads:
+            bpy.context.scene.render.threads_mode = 'FIXED'
+            bpy.context.scene.render.threads = args.render_threads
+
+
+def open_render_blend(args):
+    """Open the render scene used for the thumbnails"""
+    from . import utils
+
+    render_blend = args.render_blend
+    if not render_blend and not bpy.data.filepath:
+        render_blend = os.path.join(os.path.dirname(os.path.realpath(__file__)), "render.blend")
+
+    if render_blend:
+        bpy.ops.wm.open_mainfile(filepath= os.path.abspath(render_blend))
+
+    if not bpy.context.scene.camera:
+        raise ValueError("The render scene has no active camera")
+
+    utils.prepare_render()
+
+
+def run_operator(args):
+    """Call the operator matching the command"""
+    from . import utils
+
+    props = utils.get_props()
+    if args.command == "thumbs":
+        # the same steps as the test render, without opening a render window
+        if not props.resume_render:
+            utils.create_log_file(props.kpack_folder)
+        props.batch_render_enabled = True
+
+    category, name = COMMANDS[args.command].split(".")
+    operator = getattr(getattr(bpy.ops, category), name)
+    if not operator.poll():
+        raise ValueError(f"Cannot run {args.command}, check the input folders and files")
+
+    if args.command in SHARDED_COMMANDS and args.items_file:
+        return operator(items_file= args.items_file)
+    return operator()
+
+
+def get_items(args):
+    """Get the items a command processes and the folder of its log file"""
+    from . import incremental
+    from . import utils
+
+    props = utils.get_props()
+    if args.command == "thumbs":
+        blend_files = utils.get_blends(props.kpack_folder)
+        if props.incremental_render:
+            # only the outdated thumbnails are split over the workers
+            entries = incremental.load_manifest(props.kpack_folder)
+            fingerprint = incremental.render_fingerprint(bpy.context.scene, props)
+            blend_files = incremental.get_stale_blends(blend_files, entries, fingerprint)
+        return blend_files, props.kpack_folder
+    elif args.command == "obj-to-blend":
+        return utils.get_objs(bpy.path.abspath(props.obj_folder)), None
+    else:
+        return utils.get_pngs(props.images_folder), props.images_folder
+
+
+def run_pool(args, script_args):
+    """Split the items over several background workers and merge their logs
+
+    For thumbnails the journal is replayed after each round, the blends
+    left by crashed workers are given to new workers until they finish or
+    get quarantined.
+    """
+    from . import incremental
+    from . import journal
+    from . import pool
+    from . import profiling
+    from . import utils
+
+    props = utils.get_props()
+    is_thumbs = args.command == "thumbs"
+    items, log_folder = get_items(args)
+    if not items:
+        print(f"KIT OPS BATCH: nothing to process for {args.command}")
+        return {'FINISHED'}
+
+    if log_folder and not (is_thumbs and props.resume_render):
+        utils.create_log_file(log_folder)
+
+    # the workers get the same options, except for the pool options
+    command_args = pool.strip_option(script_args, "--workers")
+    command_args = pool.strip_option(command_args, "--render-blend")
+
+    if is_thumbs:
+        # the coordinator decides what is left to do, the workers always
+        # append to the journal
+        command_args = [arg for arg in command_args if arg != "--resume"] + ["--resume"]
+        if not props.resume_render:
+            journal.create_journal(log_folder)
+
+    start_time = time.perf_counter()
+    report_folder = log_folder or bpy.path.abspath(props.obj_folder)
+    report_paths = []
+
+    rounds = props.max_crashes + 1 if is_thumbs else 1
+    pending = items
+    quarantined = []
+    work_dir = pool.create_work_dir()
+    try:
+        for i in range(rounds):
+            if is_thumbs:
+                entries = journal.replay([journal.get_journal_path(log_folder)])
+                pending, quarantined = journal.get_pending(items, entries, props.max_crashes)
+                if not pending:
+                    break
+
+            results = pool.run_workers(
+                bpy.app.binary_path,
+                bpy.data.filepath,
+                os.path.realpath(__file__),
+                command_args,
+                pending,
+                args.workers,
+                work_dir
+            )
+
+            suffixes = [suffix for suffix, code in results]
+            report_paths += [utils.get_profile_path(report_folder, suffix) for suffix in suffixes]
+            if log_folder:
+                pool.merge_logs(utils.get_log_file_path(log_folder), suffixes, pending)
+                props.log_file_created = True
+
+            if args.command == "obj-to-blend":
+                utils.merge_duplicate_reports(report_folder, suffixes)
+
+            if is_thumbs:
+                journal.merge_journals(log_folder, suffixes)
+                if props.incremental_render:
+                    incremental.merge_manifests(log_folder, suffixes)
+
+            if all(code == 0 for suffix, code in results):
+                break
+        else:
+            return {'CANCELLED'}
+    finally:
+        pool.remove_work_dir(work_dir)
+
+    if args.profile:
+        profiling.merge_reports(report_paths, utils.get_profile_path(report_folder, ""), time.perf_counter() - start_time)
+
+    for blend in quarantined:
+        print(f"KIT OPS BATCH: quarantined {blend}")
+    return {'FINISHED'}
+
+
+def main(argv=None):
+    """Parse the command line and run the requested batch pipeline"""
+    script_args = get_script_args(argv)
+    args = build_parser().parse_args(script_args)
+
+    try:
+        if not enable_addon():
+            raise ValueError(f"Unable to enable the {get_addon_name()} addon")
+
+        if args.command == "thumbs":
+            # opening a file resets the window manager properties,
+            # so it has to happen before the options are applied
+            open_render_blend(args)
+
+        from . import utils
+        apply_args(utils.get_props(), args)
+        if args.command in SHARDED_COMMANDS and args.workers > 1:
+            result = run_pool(args, script_args)
+        else:
+            result = run_operator(args)
+    except (ValueError, RuntimeError) as error:
+        print(f"KIT OPS BATCH: {error}", file= sys.stderr)
+        return 1
+
+    print(f"KIT OPS BATCH: {args.command} {', '.join(sorted(result))}")
+    return 0 if 'FINISHED' in result else 1
+
+
+if __name__ == "__main__":
+    # executed as a script with -P, run the registered addon module instead
+    # so the relative imports of the addon work
+    addon_parent = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if addon_parent not in sys.path:
+        sys.path.append(addon_parent)
+    enable_addon()
+    cli = importlib.import_module(get_addon_name() + ".cli")
+    sys.exit(cli.main())
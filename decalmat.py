@@ -0,0 +1,231 @@
+"""Shared node group for the decal materials
+
+The decal template material is split in two. The 'decal' image node and
+the nodes feeding it stay in a thin wrapper material, everything between
+the image and the material output moves to a node group. Every decal gets
+a copy of the wrapper, with its own image, around the same node group.
+
+The node group is written to a library blend next to the decals and linked
+from there, so the inserts placed in one scene all use the same linked
+group instead of appending a copy each.
+"""
+import os
+
+import bpy
+
+# interface socket types of the node socket types
+SOCKET_TYPES = {
+    'RGBA': "NodeSocketColor",
+    'VALUE': "NodeSocketFloat",
+    'INT': "NodeSocketInt",
+    'BOOLEAN': "NodeSocketBool",
+    'VECTOR': "NodeSocketVector",
+    'SHADER': "NodeSocketShader",
+}
+
+# node properties that are not copied from the template
+SKIPPED_PROPERTIES = {"rna_type", "name", "parent", "select", "type"}
+
+
+def get_socket(sockets, identifier):
+    """Get a socket by its identifier"""
+    for socket in sockets:
+        if socket.identifier == identifier:
+            return socket
+    return None
+
+
+def new_socket(group, name, in_out, socket_type):
+    """Add an input or output to the interface of a node group"""
+    if hasattr(group, "interface"):
+        group.interface.new_socket(name= name, in_out= in_out, socket_type= socket_type)
+    elif in_out == 'INPUT':
+        group.inputs.new(socket_type, name)
+    else:
+        group.outputs.new(socket_type, name)
+
+
+def copy_curve_mapping(source, target):
+    """Copy the points of a curve mapping"""
+    for source_curve, curve in zip(source.curves, target.curves):
+        while len(curve.points) < len(source_curve.points):
+            curve.points.new(0.0, 0.0)
+        for source_point, point in zip(source_curve.points, curve.points):
+            point.location = source_point.location
+            point.handle_type = source_point.handle_type
+    target.update()
+
+
+def copy_color_ramp(source, target):
+    """Copy the elements and interpolation of a color ramp"""
+    target.color_mode = source.color_mode
+    target.interpolation = source.interpolation
+    target.hue_interpolation = source.hue_interpolation
+    while len(target.elements) < len(source.elements):
+        target.elements.new(0.0)
+    for source_element, element in zip(source.elements, target.elements):
+        element.position = source_element.position
+        element.color = source_element.color
+
+
+def copy_node(node, nodes):
+    """Copy a shader node with its settings and unlinked input values to nodes"""
+    copy = nodes.new(node.bl_idname)
+    copy.name = node.name
+    for prop in node.bl_rna.properties:
+        identifier = prop.identifier
+        if prop.is_readonly or identifier in SKIPPED_PROPERTIES or identifier.startswith("bl_"):
+            continue
+        try:
+            setattr(copy, identifier, getattr(node, identifier))
+        except (AttributeError, TypeError, ValueError, RuntimeError):
+            pass
+
+    if getattr(node, "color_ramp", None):
+        copy_color_ramp(node.color_ramp, copy.color_ramp)
+    if getattr(node, "mapping", None) and hasattr(node.mapping, "curves"):
+        copy_curve_mapping(node.mapping, copy.mapping)
+
+    for sockets, copy_sockets in ((node.inputs, copy.inputs), (node.outputs, copy.outputs)):
+        for socket in sockets:
+            copy_socket = get_socket(copy_sockets, socket.identifier)
+            if copy_socket is None:
+                continue
+            if hasattr(socket, "default_value"):
+                try:
+                    copy_socket.default_value = socket.default_value
+                except (AttributeError, TypeError, ValueError):
+                    pass
+            copy_socket.hide = socket.hide
+    return copy
+
+
+def get_upstream_nodes(node):
+    """Get the names of node and every node linked to its inputs"""
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.name in names:
+            continue
+        names.add(node.name)
+        for socket in node.inputs:
+            for link in socket.links:
+                stack.append(link.from_node)
+    return names
+
+
+def unique_name(name, names, prefix):
+    """Get a socket name not used yet in names"""
+    if name in names:
+        name = f"{prefix} {name}"
+    names.append(name)
+    return name
+
+
+def get_library_path(images_folder, template_file):
+    """Get the path of the library blend holding the shared node group of a template"""
+    template_name = os.path.splitext(os.path.basename(bpy.path.abspath(template_file)))[0]
+    return os.path.join(bpy.path.abspath(images_folder), template_name + "_shader.blend")
+
+
+def link_group(group, library_path):
+    """Write a node group to a library blend and link it back instead of the local group"""
+    # workers write the same group, the file is replaced atomically
+    tmp_path = f"{os.path.splitext(library_path)[0]}.{os.getpid()}.tmp.blend"
+    bpy.data.libraries.write(tmp_path, {group}, fake_user= True)
+    os.replace(tmp_path, library_path)
+
+    name = group.name
+    bpy.data.node_groups.remove(group)
+    with bpy.data.libraries.load(library_path, link= True) as (data_from, data_to):
+        data_to.node_groups = [name]
+    return data_to.node_groups[0]
+
+
+def remove_library(library_path):
+    """Remove the library of the shared node group and the data linked from it"""
+    for library in bpy.data.libraries:
+        if os.path.normpath(bpy.path.abspath(library.filepath)) == os.path.normpath(library_path):
+            bpy.data.libraries.remove(library)
+            return
+
+
+def make_shared_material(template_name, library_path= None, group_name= "Batch DECAL Shader"):
+    """Split the decal template material into a wrapper material and a node group
+
+    With library_path the node group is linked from that library blend.
+    Returns the name of the wrapper material, or the name of the template
+    when its nodes can't be split.
+    """
+    template = bpy.data.materials.get(template_name)
+    if template is None or not template.use_nodes:
+        return template_name
+
+    tree = template.node_tree
+    decal = tree.nodes.get('decal')
+    output_nodes = [node for node in tree.nodes if node.type == 'OUTPUT_MATERIAL']
+    if decal is None or not output_nodes:
+        print("The decal template can't be shared, its material is copied for every decal")
+        return template_name
+
+    kept = get_upstream_nodes(decal) | {node.name for node in output_nodes}
+    grouped = [node for node in tree.nodes if node.name not in kept and node.type != 'FRAME']
+    grouped_names = {node.name for node in grouped}
+    if not grouped:
+        return template_name
+
+    group = bpy.data.node_groups.new(group_name, 'ShaderNodeTree')
+    group_input = group.nodes.new('NodeGroupInput')
+    group_output = group.nodes.new('NodeGroupOutput')
+    for node in grouped:
+        copy_node(node, group.nodes)
+
+    # the links entering and leaving the group become its interface
+    inputs = []
+    outputs = []
+    input_names = []
+    output_names = []
+    for link in tree.links:
+        from_name, to_name = link.from_node.name, link.to_node.name
+        if from_name in grouped_names and to_name in grouped_names:
+            group.links.new(
+                get_socket(group.nodes[from_name].outputs, link.from_socket.identifier),
+                get_socket(group.nodes[to_name].inputs, link.to_socket.identifier))
+            continue
+
+        if to_name in grouped_names:
+            source = (from_name, link.from_socket.identifier)
+            if source not in inputs:
+                inputs.append(source)
+                name = unique_name(link.from_socket.name, input_names, from_name)
+                new_socket(group, name, 'INPUT', SOCKET_TYPES.get(link.from_socket.type, "NodeSocketColor"))
+            group.links.new(group_input.outputs[inputs.index(source)],
+                get_socket(group.nodes[to_name].inputs, link.to_socket.identifier))
+        elif from_name in grouped_names:
+            target = (to_name, link.to_socket.identifier)
+            outputs.append(target)
+            name = unique_name(link.to_socket.name, output_names, to_name)
+            new_socket(group, name, 'OUTPUT', SOCKET_TYPES.get(link.to_socket.type, "NodeSocketShader"))
+            group.links.new(get_socket(group.nodes[from_name].outputs, link.from_socket.identifier),
+                group_output.inputs[len(outputs) - 1])
+
+    if library_path:
+        group = link_group(group, library_path)
+
+    # the wrapper keeps the material settings and the image nodes of the template
+    wrapper = template.copy()
+    wrapper.name = template_name + " Wrapper"
+    nodes = wrapper.node_tree.nodes
+    for name in grouped_names:
+        nodes.remove(nodes[name])
+
+    group_node = nodes.new('ShaderNodeGroup')
+    group_node.node_tree = group
+    group_node.location = decal.location.x + 300, decal.location.y
+    links = wrapper.node_tree.links
+    for index, (name, identifier) in enumerate(inputs):
+        links.new(get_socket(nodes[name].outputs, identifier), group_node.inputs[index])
+    for index, (name, identifier) in enumerate(outputs):
+        links.new(group_node.outputs[index], get_socket(nodes[name].inputs, identifier))
+    return wrapper.name
@@ -0,0 +1,157 @@
+"""Trim the transparent margins of decal images
+
+The opaque bounding box of the alpha channel sizes the decal plane. In UV
+mode the plane maps that part of the original image, in CROP mode a
+cropped copy of the image is written to a "trimmed" folder next to the
+images so only the opaque part is loaded. With the cut-out option the plane
+is the convex hull of the opaque pixels instead of a rectangle.
+"""
+import os
+
+import bpy
+import numpy as np
+
+# pixels kept around the opaque area for the texture filtering
+TRIM_MARGIN = 2
+
+# resolution of the grid the cut-out outline is traced on
+OUTLINE_CELLS = 32
+
+# a cut-out close to the rectangle isn't worth its extra corners
+MIN_CUTOUT_SAVING = 0.1
+
+
+def read_pixels(image):
+    """Get the pixels of an image as a (height, width, 4) array, bottom row first"""
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype= np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)
+
+
+def get_opaque_box(mask, margin= TRIM_MARGIN):
+    """Get the (x0, y0, x1, y1) box of the opaque pixels, None if there are none"""
+    rows = np.flatnonzero(mask.any(axis= 1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis= 0))
+    height, width = mask.shape
+    return (max(cols[0] - margin, 0), max(rows[0] - margin, 0),
+        min(cols[-1] + 1 + margin, width), min(rows[-1] + 1 + margin, height))
+
+
+def convex_hull(points):
+    """Get the convex hull of 2D points, counter-clockwise"""
+    points = np.unique(points, axis= 0)
+    if len(points) < 3:
+        return points
+
+    def half(points):
+        hull = []
+        for p in points:
+            while len(hull) >= 2:
+                (ax, ay), (bx, by) = hull[-2], hull[-1]
+                if (bx - ax) * (p[1] - ay) - (by - ay) * (p[0] - ax) > 0:
+                    break
+                hull.pop()
+            hull.append(p)
+        return hull
+
+    # np.unique sorts by x then y
+    lower = half(points)
+    upper = half(points[::-1])
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def get_outline(mask, box, cells= OUTLINE_CELLS):
+    """Get the convex outline of the opaque pixels inside box in pixel coordinates
+
+    The mask is reduced to a coarse grid first, every cell holding an opaque
+    pixel is inside the outline. Returns None when the outline doesn't save
+    enough area compared to the box.
+    """
+    x0, y0, x1, y1 = box
+    mask = mask[y0:y1, x0:x1]
+    height, width = mask.shape
+    cell = max(-(-max(width, height) // cells), 1)
+    ny, nx = -(-height // cell), -(-width // cell)
+    padded = np.zeros((ny * cell, nx * cell), dtype= bool)
+    padded[:height, :width] = mask
+    grid = padded.reshape(ny, cell, nx, cell).any(axis= (1, 3))
+
+    # the first and last opaque cell of every row are enough for the hull
+    rows = np.flatnonzero(grid.any(axis= 1))
+    first = grid[rows].argmax(axis= 1)
+    last = nx - 1 - grid[rows, ::-1].argmax(axis= 1)
+    corners = []
+    for dy in (0, 1):
+        corners.append(np.stack((first, rows + dy), axis= 1))
+        corners.append(np.stack((last + 1, rows + dy), axis= 1))
+    hull = convex_hull(np.concatenate(corners)) * cell
+    hull = np.minimum(hull, (width, height)).astype(np.float32)
+
+    x, y = hull[:, 0], hull[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    if area > (1.0 - MIN_CUTOUT_SAVING) * width * height:
+        return None
+    return hull + (x0, y0)
+
+
+def get_trimmed_path(image_path):
+    """Get the path of the cropped copy of an image"""
+    folder, name = os.path.split(image_path)
+    return os.path.join(folder, "trimmed", name)
+
+
+def crop_image(image, pixels, box, path):
+    """Write the box of the image pixels to a new PNG and load it instead of image
+
+    The source image is removed and the cropped file is loaded without
+    decoding its pixels, like the other decal images.
+    """
+    x0, y0, x1, y1 = box
+    cropped = bpy.data.images.new(image.name, x1 - x0, y1 - y0, alpha= True)
+    cropped.pixels.foreach_set(np.ascontiguousarray(pixels[y0:y1, x0:x1]).ravel())
+    os.makedirs(os.path.dirname(path), exist_ok= True)
+    cropped.filepath_raw = path
+    cropped.file_format = 'PNG'
+    cropped.save()
+    bpy.data.images.remove(cropped)
+
+    colorspace = image.colorspace_settings.name
+    bpy.data.images.remove(image)
+    image = bpy.data.images.load(path)
+    image.colorspace_settings.name = colorspace
+    return image
+
+
+def trim_decal(image, image_path, mode, cutout, threshold):
+    """Trim the transparent margins of a decal image
+
+    Returns the image to use, its size and the outline of the plane in the
+    UV space of that image, None for the whole image. The decoded pixels
+    are freed before returning.
+    """
+    pixels = read_pixels(image)
+    mask = pixels[:, :, 3] > threshold
+    height, width = mask.shape
+    box = get_opaque_box(mask)
+    if box is None:
+        print(f"{image.name} is fully transparent, not trimmed")
+        image.buffers_free()
+        return image, (width, height), None
+
+    outline = get_outline(mask, box) if cutout else None
+    x0, y0, x1, y1 = box
+    if mode == 'CROP' and (x1 - x0, y1 - y0) != (width, height):
+        image = crop_image(image, pixels, box, get_trimmed_path(image_path))
+        if outline is not None:
+            outline -= (x0, y0)
+        width, height = x1 - x0, y1 - y0
+        x0, y0, x1, y1 = 0, 0, width, height
+    else:
+        image.buffers_free()
+
+    if outline is None:
+        outline = np.array(((x0, y0), (x1, y0), (x1, y1), (x0, y1)), dtype= np.float32)
+    return image, (width, height), outline / (width, height)
@@ -0,0 +1,119 @@
+"""On-disk cache of parsed OBJ geometry
+
+The arrays read by objio are stored as .npy files in a folder named after
+the hash of the OBJ file content, later conversions of the same file load
+them memory-mapped instead of parsing the text again. The MTL files are
+small and always read again. The least recently used entries are removed
+when the cache grows over its size limit.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import bpy
+import numpy as np
+
+from .incremental import file_hash
+
+CACHE_VERSION = 1
+
+ARRAYS = ("positions", "uvs", "normals", "face_sizes", "corner_v", "corner_vt", "corner_vn",
+    "face_state", "edges", "edge_state")
+
+
+def get_default_folder():
+    """Get the cache folder used when none is set in the preferences"""
+    return os.path.join(tempfile.gettempdir(), "kitops-batch-geocache")
+
+
+def get_entry_size(path):
+    """Get the size of the files of a cache entry"""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class GeometryCache:
+    """Content addressed geometry cache with a size limit, safe to use from threads"""
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok= True)
+        self.sizes = {}
+        for entry in os.scandir(folder):
+            if entry.is_dir() and not entry.name.startswith("tmp"):
+                self.sizes[entry.name] = get_entry_size(entry.path)
+
+    def get_key(self, obj_path):
+        return f"{file_hash(obj_path)}-{CACHE_VERSION}"
+
+    def load(self, key, data):
+        """Fill data with the cached arrays, returns False on a cache miss"""
+        path = os.path.join(self.folder, key)
+        try:
+            with open(os.path.join(path, "meta.json")) as meta_file:
+                meta = json.load(meta_file)
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode= 'r') for name in ARRAYS}
+        except (OSError, ValueError):
+            return False
+
+        for name, array in arrays.items():
+            setattr(data, name, array)
+        data.states = [tuple(state) for state in meta["states"]]
+        data.mtllibs = meta["mtllibs"]
+        # the modification time orders the entries for the eviction
+        os.utime(path)
+        return True
+
+    def store(self, key, data):
+        """Write the arrays of data to the cache and evict old entries"""
+        tmp_path = tempfile.mkdtemp(prefix= "tmp", dir= self.folder)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(data, name))
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as meta_file:
+            json.dump({"states": data.states, "mtllibs": data.mtllibs}, meta_file)
+
+        path = os.path.join(self.folder, key)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # the same content was stored by another thread
+            shutil.rmtree(tmp_path, ignore_errors= True)
+            return
+
+        with self.lock:
+            self.sizes[key] = get_entry_size(path)
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits its size limit"""
+        total = sum(self.sizes.values())
+        if total <= self.max_size:
+            return
+
+        def last_use(key):
+            try:
+                return os.path.getmtime(os.path.join(self.folder, key))
+            except OSError:
+                return 0.0
+
+        for key in sorted(self.sizes, key= last_use):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.folder, key), ignore_errors= True)
+            total -= self.sizes.pop(key)
+
+    def clear(self):
+        """Remove every entry"""
+        with self.lock:
+            for key in list(self.sizes):
+                shutil.rmtree(os.path.join(self.folder, key), ignore_errors= True)
+            self.sizes.clear()
+
+
+def get_cache(prefs):
+    """Get the geometry cache configured in the preferences"""
+    folder = bpy.path.abspath(prefs.geometry_cache_folder) or get_default_folder()
+    return GeometryCache(folder, prefs.geometry_cache_size * 2**20)
@@ -0,0 +1,144 @@
+"""Keep track of rendered thumbnails to skip up-to-date INSERTS
+
+For every rendered INSERT the manifest stores the blend file size, mtime
+and content hash together with a fingerprint of the render settings.
+An INSERT is rendered again only when one of them changed or when its
+thumbnail is missing.
+"""
+import hashlib
+import json
+import os
+
+import bpy
+
+from .budget import get_budget_fingerprint
+from .utils import get_kpack_name
+
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(kpack_folder_path, suffix= ""):
+    """Get the manifest file path of a kpack folder"""
+    kpack_name = get_kpack_name(kpack_folder_path)
+    abs_path = bpy.path.abspath(kpack_folder_path)
+    return os.path.join(abs_path, kpack_name + suffix + ".thumbs.json")
+
+
+def read_manifest_file(path):
+    """Read the entries of a manifest file, a missing or broken file is empty"""
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("inserts", {})
+
+
+def load_manifest(kpack_folder_path, suffix= ""):
+    """Load the manifest entries, a worker also sees its own shard entries"""
+    entries = read_manifest_file(get_manifest_path(kpack_folder_path))
+    if suffix:
+        entries.update(read_manifest_file(get_manifest_path(kpack_folder_path, suffix)))
+    return entries
+
+
+def save_manifest(kpack_folder_path, entries, suffix= ""):
+    """Write the manifest entries, replacing the file atomically"""
+    path = get_manifest_path(kpack_folder_path, suffix)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump({"version": MANIFEST_VERSION, "inserts": entries}, manifest_file, indent= 1, sort_keys= True)
+    os.replace(tmp_path, path)
+
+
+def merge_manifests(kpack_folder_path, suffixes):
+    """Merge the manifests written by the workers into the main manifest"""
+    entries = read_manifest_file(get_manifest_path(kpack_folder_path))
+    for suffix in suffixes:
+        shard_path = get_manifest_path(kpack_folder_path, suffix)
+        if os.path.exists(shard_path):
+            entries.update(read_manifest_file(shard_path))
+            os.remove(shard_path)
+    save_manifest(kpack_folder_path, entries)
+
+
+def file_hash(path, block_size= 1 << 20):
+    """Get the sha1 hash of a file content"""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def blend_signature(blend_path, previous= None):
+    """Get the size, mtime and content hash of a blend file
+
+    The hash of the previous entry is reused when size and mtime didn't change.
+    """
+    stat = os.stat(blend_path)
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime_ns:
+        signature["hash"] = previous.get("hash")
+    else:
+        signature["hash"] = file_hash(blend_path)
+    return signature
+
+
+def render_fingerprint(scene, props):
+    """Get a hash of the render settings affecting the thumbnails"""
+    render = scene.render
+    settings = {
+        "auto_camera_pos": props.auto_camera_pos,
+        "camera_padding": round(props.camera_padding, 6),
+        "resolution": (render.resolution_x, render.resolution_y, render.resolution_percentage),
+        "engine": render.engine,
+        "file_format": render.image_settings.file_format,
+        "film_transparent": render.film_transparent,
+        "budget": get_budget_fingerprint(props),
+    }
+
+    if render.engine == 'CYCLES':
+        settings["samples"] = scene.cycles.samples
+    elif hasattr(scene, "eevee"):
+        settings["samples"] = scene.eevee.taa_render_samples
+
+    camera = scene.camera
+    if camera:
+        settings["camera"] = {
+            "lens": round(camera.data.lens, 6),
+            "type": camera.data.type,
+            "rotation": [round(v, 6) for v in camera.matrix_world.to_euler()],
+        }
+        if not props.auto_camera_pos:
+            # without auto alignment the camera location is part of the framing
+            settings["camera"]["location"] = [round(v, 6) for v in camera.matrix_world.translation]
+            settings["camera"]["ortho_scale"] = round(camera.data.ortho_scale, 6)
+
+    return hashlib.sha1(json.dumps(settings, sort_keys= True).encode()).hexdigest()
+
+
+def get_thumb_path(blend_path):
+    """Get the thumbnail path written next to the blend file"""
+    return os.path.splitext(blend_path)[0] + ".png"
+
+
+def is_up_to_date(entry, signature, fingerprint, blend_path):
+    """Check if the thumbnail of a blend file doesn't need to be rendered again"""
+    if not entry or not os.path.exists(get_thumb_path(blend_path)):
+        return False
+    return entry.get("hash") == signature["hash"] and entry.get("fingerprint") == fingerprint
+
+
+def get_stale_blends(blend_files, entries, fingerprint):
+    """Filter the blend files whose thumbnail has to be rendered"""
+    stale = []
+    for blend in blend_files:
+        entry = entries.get(os.path.basename(blend))
+        if not is_up_to_date(entry, blend_signature(blend, entry), fingerprint, blend):
+            stale.append(blend)
+    return stale
@@ -0,0 +1,123 @@
+"""Crash-safe journal of the thumbnail batch
+
+Every state change of a blend file (running, done, failed) is appended to
+a JSON lines file and flushed to disk before the batch moves on. Replaying
+the journal tells which blends are still pending after a crash, and a blend
+that was left running by several crashed runs is quarantined.
+"""
+import json
+import os
+import time
+
+import bpy
+
+from .utils import get_kpack_name
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_journal_path(kpack_folder_path, suffix= ""):
+    """Get the journal file path of a kpack folder"""
+    kpack_name = get_kpack_name(kpack_folder_path)
+    abs_path = bpy.path.abspath(kpack_folder_path)
+    return os.path.join(abs_path, kpack_name + suffix + ".journal")
+
+
+def create_journal(kpack_folder_path):
+    """Start a new empty journal"""
+    with open(get_journal_path(kpack_folder_path), 'w'):
+        pass
+
+
+class Journal:
+    """Append only journal, every record is fsync'd"""
+
+    def __init__(self, path, resume= False):
+        self.path = path
+        self.file = open(path, 'a' if resume else 'w')
+
+    def record(self, blend, state, error= None, **info):
+        """Write the new state of a blend file"""
+        entry = {"blend": blend, "state": state, "time": time.time()}
+        if error:
+            entry["error"] = error
+        entry.update(info)
+
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def replay(paths):
+    """Get the last state of every blend from the journal files
+
+    Each entry holds the state, the last error and the number of runs that
+    crashed while the blend was running.
+    """
+    entries = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line can be incomplete after a crash
+                    continue
+
+                entry = entries.setdefault(record["blend"], {"state": None, "error": None, "crashes": 0})
+                if record["state"] == RUNNING and entry["state"] == RUNNING:
+                    # started again without finishing, the previous run crashed
+                    entry["crashes"] += 1
+                entry["state"] = record["state"]
+                if record["state"] == FAILED:
+                    entry["error"] = record.get("error")
+
+    for entry in entries.values():
+        if entry["state"] == RUNNING:
+            # nothing was written after the blend started, the run crashed
+            entry["crashes"] += 1
+    return entries
+
+
+def get_pending(blend_files, entries, max_crashes):
+    """Split the blend files into the ones to run and the quarantined ones"""
+    pending = []
+    quarantined = []
+    for blend in blend_files:
+        entry = entries.get(blend)
+        if entry is None:
+            pending.append(blend)
+        elif entry["crashes"] >= max_crashes:
+            quarantined.append(blend)
+        elif entry["state"] != DONE:
+            pending.append(blend)
+    return pending, quarantined
+
+
+def merge_journals(kpack_folder_path, suffixes):
+    """Append the journals written by the workers to the main journal"""
+    with open(get_journal_path(kpack_folder_path), 'a') as journal_file:
+        for suffix in suffixes:
+            shard_path = get_journal_path(kpack_folder_path, suffix)
+            if not os.path.exists(shard_path):
+                continue
+            with open(shard_path) as shard_file:
+                for line in shard_file:
+                    if line.endswith("\n"):
+                        journal_file.write(line)
+            os.remove(shard_path)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
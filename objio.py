@@ -0,0 +1,832 @@
+"""Built-in OBJ reader and writer
+
+The OBJ file is read in large chunks, vertex positions, UVs, normals and
+face corners are parsed with numpy into flat arrays and the meshes are
+created with foreach_set instead of going through the import operator.
+Objects, groups, materials and smooth groups are kept as runs of faces so
+the file can be split the same way as the Blender importer does.
+
+Parsing doesn't touch bpy, iter_parsed() runs it on background threads
+ahead of the main thread creating the meshes and writing the blends.
+
+The writer reads the evaluated meshes with foreach_get and writes the
+v/vt/vn/f lines with large buffered writes, without selecting objects.
+Formatting and writing doesn't touch bpy either, ObjEmitter runs it on
+background threads.
+"""
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import bpy
+import numpy as np
+from bpy_extras.io_utils import axis_conversion
+from bpy_extras.node_shader_utils import PrincipledBSDFWrapper
+
+from . import profiling
+
+# bytes read from the OBJ file at once
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# temporary attributes of the imported meshes
+SMOOTH_GROUP_ATTRIBUTE = "kob_smooth_group"
+NORMAL_ATTRIBUTE = "kob_normal"
+
+TEXTURE_KEYS = ("map_kd", "map_bump", "bump", "map_d")
+
+
+class ObjData:
+    """Geometry of an OBJ file as flat arrays"""
+
+    def __init__(self):
+        self.positions = np.zeros((0, 3), dtype= np.float32)
+        self.uvs = np.zeros((0, 2), dtype= np.float32)
+        self.normals = np.zeros((0, 3), dtype= np.float32)
+        # number of corners of every face and the 0 based indices of every
+        # corner, -1 when the corner has no UV or normal
+        self.face_sizes = np.zeros(0, dtype= np.int32)
+        self.corner_v = np.zeros(0, dtype= np.int32)
+        self.corner_vt = np.zeros(0, dtype= np.int32)
+        self.corner_vn = np.zeros(0, dtype= np.int32)
+        # index in states of every face and every line edge
+        self.face_state = np.zeros(0, dtype= np.int32)
+        self.edges = np.zeros((0, 2), dtype= np.int32)
+        self.edge_state = np.zeros(0, dtype= np.int32)
+        # (object name, group name, material name, smooth group)
+        self.states = []
+        self.mtllibs = []
+        # MTL statements of the used materials and the texture file paths
+        self.materials = {}
+        self.images = {}
+
+
+def parse_floats(lines, width):
+    """Parse the values of v/vt/vn lines, extra values are dropped"""
+    if not lines:
+        return np.zeros((0, width), dtype= np.float32)
+    values = np.array(b" ".join(lines).split(), dtype= np.float64)
+    if values.size == len(lines) * width:
+        return values.reshape(-1, width).astype(np.float32)
+
+    rows = [line.split() for line in lines]
+    counts = set(map(len, rows))
+    if len(counts) == 1 and min(counts) >= width:
+        # w components or vertex colors on every line are dropped
+        return np.array(rows, dtype= np.float64)[:, :width].astype(np.float32)
+
+    # mixed or missing values, missing ones are 0
+    padded = [row[:width] + [b"0"] * (width - len(row)) for row in rows]
+    return np.array(padded, dtype= np.float64).reshape(-1, width).astype(np.float32)
+
+
+def parse_corners(corners):
+    """Parse the v/vt/vn face corners, missing indices are 0"""
+    count = len(corners)
+    if not count:
+        return np.zeros((0, 3), dtype= np.int64)
+
+    joined = b" ".join(corners)
+    first = corners[0]
+    slashes = first.count(b"/")
+    double = b"//" in first
+    if joined.count(b"/") == slashes * count and (not double or joined.count(b"//") == count):
+        # every corner has the same layout
+        if double:
+            columns = (0, 2)
+            joined = joined.replace(b"//", b" ")
+        else:
+            columns = (0, 1, 2)[:slashes + 1]
+            joined = joined.replace(b"/", b" ")
+        values = np.array(joined.split(), dtype= np.int64)
+        if values.size == count * len(columns):
+            indices = np.zeros((count, 3), dtype= np.int64)
+            indices[:, columns] = values.reshape(count, len(columns))
+            return indices
+
+    indices = np.zeros((count, 3), dtype= np.int64)
+    for i, corner in enumerate(corners):
+        for j, value in enumerate(corner.split(b"/")[:3]):
+            if value:
+                indices[i, j] = int(value)
+    return indices
+
+
+def resolve_indices(indices, bases):
+    """Convert 1 based and negative OBJ indices to 0 based, missing ones to -1"""
+    return np.where(indices > 0, indices - 1, np.where(indices < 0, bases + indices, -1))
+
+
+def read_obj(path, chunk_size= CHUNK_SIZE):
+    """Read the geometry of an OBJ file"""
+    data = ObjData()
+    states = {}
+    positions, uvs, normals = [], [], []
+    sizes, corner_indices, corner_bases = [], [], []
+    face_state, edges, edge_state = [], [], []
+
+    obj_name, group_name, material, smooth = b"", b"", b"", 0
+    state = states.setdefault((obj_name, group_name, material, smooth), 0)
+    nv = nvt = nvn = 0
+
+    with open(path, 'rb') as obj_file:
+        while True:
+            lines = obj_file.readlines(chunk_size)
+            if not lines:
+                break
+
+            v_lines, vt_lines, vn_lines = [], [], []
+            chunk_corners, chunk_faces = [], []
+            for line in lines:
+                start = line[:2]
+                if start == b"v ":
+                    v_lines.append(line[2:])
+                    nv += 1
+                elif start == b"vt":
+                    vt_lines.append(line[3:])
+                    nvt += 1
+                elif start == b"vn":
+                    vn_lines.append(line[3:])
+                    nvn += 1
+                elif start == b"f ":
+                    tokens = line.split()[1:]
+                    chunk_corners += tokens
+                    chunk_faces.append((len(tokens), state, nv, nvt, nvn))
+                elif start == b"l ":
+                    points = [int(token.split(b"/")[0]) for token in line.split()[1:]]
+                    points = [p - 1 if p > 0 else nv + p for p in points]
+                    edges += zip(points[:-1], points[1:])
+                    edge_state += [state] * (len(points) - 1)
+                else:
+                    line = line.strip()
+                    if line.startswith(b"o "):
+                        obj_name = line[2:].strip()
+                    elif line.startswith(b"g "):
+                        group_name = line[2:].strip()
+                    elif line.startswith(b"usemtl "):
+                        material = line[7:].strip()
+                    elif line.startswith(b"s ") or line == b"s":
+                        value = line[2:].strip()
+                        if value in (b"", b"off", b"0"):
+                            smooth = 0
+                        else:
+                            smooth = int(value) if value.isdigit() else 1
+                    elif line.startswith(b"mtllib "):
+                        data.mtllibs += line[7:].decode("utf-8", "replace").split()
+                    else:
+                        continue
+                    state = states.setdefault((obj_name, group_name, material, smooth), len(states))
+
+            positions.append(parse_floats(v_lines, 3))
+            uvs.append(parse_floats(vt_lines, 2))
+            normals.append(parse_floats(vn_lines, 3))
+            if chunk_faces:
+                faces = np.array(chunk_faces, dtype= np.int64)
+                corner_indices.append(parse_corners(chunk_corners))
+                corner_bases.append(np.repeat(faces[:, 2:], faces[:, 0], axis= 0))
+                sizes.append(faces[:, 0])
+                face_state.append(faces[:, 1])
+
+    data.positions = np.concatenate(positions) if positions else data.positions
+    data.uvs = np.concatenate(uvs) if uvs else data.uvs
+    data.normals = np.concatenate(normals) if normals else data.normals
+    if sizes:
+        indices = resolve_indices(np.concatenate(corner_indices), np.concatenate(corner_bases))
+        data.face_sizes = np.concatenate(sizes).astype(np.int32)
+        data.face_state = np.concatenate(face_state).astype(np.int32)
+        data.corner_v = indices[:, 0].astype(np.int32)
+        data.corner_vt = indices[:, 1].astype(np.int32)
+        data.corner_vn = indices[:, 2].astype(np.int32)
+    if edges:
+        data.edges = np.array(edges, dtype= np.int32)
+        data.edge_state = np.array(edge_state, dtype= np.int32)
+
+    data.states = [(o.decode("utf-8", "replace"), g.decode("utf-8", "replace"), m.decode("utf-8", "replace"), s)
+        for (o, g, m, s), i in sorted(states.items(), key= lambda item: item[1])]
+    return data
+
+
+# ____________________________________________________
+# materials
+
+def find_image(folder, name, image_search= False):
+    """Find a texture file relative to the OBJ folder"""
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        return path
+    if image_search:
+        basename = os.path.basename(name.replace("\\", "/"))
+        for root, dirs, files in os.walk(folder):
+            if basename in files:
+                return os.path.join(root, basename)
+    return None
+
+
+def warm_file(path, block_size= 1 << 20):
+    """Read a file so the next read comes from the system cache"""
+    with open(path, 'rb') as f:
+        while f.read(block_size):
+            pass
+
+
+def read_mtl(path):
+    """Read the materials of a MTL file as dictionaries of statements"""
+    materials = {}
+    current = None
+    with open(path, 'r', encoding= "utf-8", errors= "replace") as mtl_file:
+        for line in mtl_file:
+            words = line.split()
+            if not words or words[0].startswith("#"):
+                continue
+            if words[0] == "newmtl":
+                current = materials.setdefault(" ".join(words[1:]), {})
+            elif current is not None:
+                current[words[0].lower()] = words[1:]
+    return materials
+
+
+def get_texture_name(statements, key):
+    """Get the texture file of a map statement, the options come before it"""
+    words = statements.get(key)
+    return words[-1] if words else None
+
+
+def read_materials(data, folder, image_search= False):
+    """Read the MTL statements of the used materials and find their textures
+
+    Doesn't use bpy, it runs on the parsing threads.
+    """
+    statements = {}
+    for mtllib in data.mtllibs:
+        path = os.path.join(folder, mtllib)
+        if os.path.exists(path):
+            statements.update(read_mtl(path))
+
+    for obj_name, group_name, name, smooth in data.states:
+        if name and name not in data.materials:
+            data.materials[name] = statements.get(name, {})
+
+    for material in data.materials.values():
+        for key in TEXTURE_KEYS:
+            texture = get_texture_name(material, key)
+            if texture and texture not in data.images:
+                path = find_image(folder, texture, image_search)
+                if path is None:
+                    print(f"Image {texture} not found")
+                else:
+                    warm_file(path)
+                data.images[texture] = path
+
+
+def load_image(data, texture):
+    """Load a texture image, None if it wasn't found"""
+    path = data.images.get(texture)
+    if path is None:
+        return None
+    return bpy.data.images.load(path, check_existing= True)
+
+
+def create_material(name, statements, data):
+    """Create a node material from MTL statements"""
+    material = bpy.data.materials.new(name)
+    wrap = PrincipledBSDFWrapper(material, is_readonly= False)
+
+    if "kd" in statements:
+        wrap.base_color = [float(v) for v in statements["kd"][:3]]
+    if "ns" in statements:
+        wrap.roughness = 1.0 - min(float(statements["ns"][0]), 1000.0) / 1000.0
+    if "d" in statements:
+        wrap.alpha = float(statements["d"][0])
+    elif "tr" in statements:
+        wrap.alpha = 1.0 - float(statements["tr"][0])
+
+    image = load_image(data, get_texture_name(statements, "map_kd"))
+    if image:
+        wrap.base_color_texture.image = image
+    image = load_image(data, get_texture_name(statements, "map_bump") or get_texture_name(statements, "bump"))
+    if image:
+        wrap.normalmap_texture.image = image
+    image = load_image(data, get_texture_name(statements, "map_d"))
+    if image:
+        wrap.alpha_texture.image = image
+    return material
+
+
+def create_materials(data):
+    """Create the materials used by the faces, by material name"""
+    return {name: create_material(name, statements, data) for name, statements in data.materials.items()}
+
+
+def parse_obj_file(file_path, image_search= False, cache= None):
+    """Read an OBJ file with its materials and textures, without bpy
+
+    With a geometry cache the arrays of an already parsed file are loaded
+    from it instead.
+    """
+    data = None
+    if cache:
+        key = cache.get_key(file_path)
+        data = ObjData()
+        if not cache.load(key, data):
+            data = None
+
+    if data is None:
+        data = read_obj(file_path)
+        if cache:
+            cache.store(key, data)
+
+    read_materials(data, os.path.dirname(file_path), image_search)
+    return data
+
+
+def iter_parsed(paths, lookahead= 2, image_search= False, cache= None):
+    """Parse OBJ files on background threads ahead of their use
+
+    Yields (path, parsed data) in order, at most lookahead files are parsed
+    in advance. Without lookahead the files are parsed on the main thread.
+    """
+    if lookahead < 1:
+        for path in paths:
+            yield path, parse_obj_file(path, image_search, cache)
+        return
+
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers= lookahead) as executor:
+        pending = deque((path, executor.submit(parse_obj_file, path, image_search, cache))
+            for path in itertools.islice(paths, lookahead))
+        while pending:
+            path, future = pending.popleft()
+            with profiling.stage("obj_wait"):
+                data = future.result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(parse_obj_file, next_path, image_search, cache)))
+            yield path, data
+
+
+# ____________________________________________________
+# meshes
+
+def get_global_matrix(props, positions):
+    """Get the axis conversion matrix, scaled down to the clamp size"""
+    matrix = axis_conversion(from_forward= props.axis_forward, from_up= props.axis_up).to_4x4()
+    clamp_size = props.global_clight_size
+    if clamp_size and len(positions):
+        size = float((positions.max(axis= 0) - positions.min(axis= 0)).max())
+        scale = 1.0
+        while size * scale > clamp_size:
+            scale /= 10.0
+        for i in range(3):
+            matrix[i][i] *= scale
+    return matrix
+
+
+def get_parts(data, props):
+    """Group the faces into the objects to create, returns (name, face mask, edge mask)"""
+    split_objects = props.split_mode == 'ON' and props.use_split_objects
+    split_groups = props.split_mode == 'ON' and props.use_split_groups
+    if not (split_objects or split_groups):
+        return [(None, None, None)]
+
+    keys = {}
+    state_part = []
+    for obj_name, group_name, material, smooth in data.states:
+        if split_objects and split_groups:
+            key = f"{obj_name}_{group_name}" if obj_name and group_name else obj_name or group_name
+        else:
+            key = obj_name if split_objects else group_name
+        state_part.append(keys.setdefault(key, len(keys)))
+
+    state_part = np.array(state_part, dtype= np.int32)
+    face_part = state_part[data.face_state]
+    edge_part = state_part[data.edge_state]
+    parts = []
+    for key, i in keys.items():
+        face_mask, edge_mask = face_part == i, edge_part == i
+        # the state before the first o/g statement usually has no faces
+        if face_mask.any() or (props.use_edges and edge_mask.any()):
+            parts.append((key or None, face_mask, edge_mask))
+    return parts
+
+
+def set_sharp_edges(mesh, loop_smooth):
+    """Mark the edges between faces of different smooth groups as sharp"""
+    edge_count = len(mesh.edges)
+    loop_edges = np.zeros(len(mesh.loops), dtype= np.int32)
+    mesh.loops.foreach_get("edge_index", loop_edges)
+
+    lowest = np.full(edge_count, np.iinfo(np.int32).max, dtype= np.int32)
+    highest = np.full(edge_count, np.iinfo(np.int32).min, dtype= np.int32)
+    np.minimum.at(lowest, loop_edges, loop_smooth)
+    np.maximum.at(highest, loop_edges, loop_smooth)
+    sharp = (lowest != highest) & (highest >= 0)
+    mesh.edges.foreach_set("use_edge_sharp", sharp)
+
+
+def build_mesh(name, data, props, matrix, materials, face_mask= None, edge_mask= None):
+    """Create a mesh from the faces and line edges selected by the masks"""
+    face_sizes = data.face_sizes
+    corner_v, corner_vt, corner_vn = data.corner_v, data.corner_vt, data.corner_vn
+    face_state = data.face_state
+    edges = data.edges if props.use_edges else data.edges[:0]
+    if face_mask is not None:
+        corner_mask = np.repeat(face_mask, face_sizes)
+        face_sizes = face_sizes[face_mask]
+        corner_v, corner_vt, corner_vn = corner_v[corner_mask], corner_vt[corner_mask], corner_vn[corner_mask]
+        face_state = face_state[face_mask]
+        if props.use_edges:
+            edges = edges[edge_mask]
+
+    if props.split_mode == 'ON':
+        # only keep the vertices used by the faces and edges
+        used, inverse = np.unique(np.concatenate((corner_v, edges.ravel())), return_inverse= True)
+        positions = data.positions[used]
+        inverse = inverse.ravel().astype(np.int32)
+        edges = inverse[len(corner_v):].reshape(-1, 2)
+        corner_v = inverse[:len(corner_v)]
+    else:
+        positions = data.positions
+
+    # the axis conversion and clamp scale are applied to the vertices
+    rotation = np.array(matrix.to_3x3(), dtype= np.float32)
+    positions = positions @ rotation.T
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(positions))
+    mesh.vertices.foreach_set("co", positions.ravel())
+    if len(edges):
+        mesh.edges.add(len(edges))
+        mesh.edges.foreach_set("vertices", edges.ravel())
+
+    loop_start = np.zeros(len(face_sizes), dtype= np.int32)
+    np.cumsum(face_sizes[:-1], out= loop_start[1:])
+    mesh.loops.add(len(corner_v))
+    mesh.loops.foreach_set("vertex_index", corner_v)
+    mesh.polygons.add(len(face_sizes))
+    mesh.polygons.foreach_set("loop_start", loop_start)
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", face_sizes)
+
+    states = data.states
+    smooth_groups = np.array([s[3] for s in states], dtype= np.int32)[face_state]
+    mesh.polygons.foreach_set("use_smooth", smooth_groups != 0)
+
+    if len(data.uvs) and (corner_vt >= 0).any():
+        uvs = data.uvs[np.maximum(corner_vt, 0)]
+        uvs[corner_vt < 0] = 0.0
+        mesh.uv_layers.new(name= "UVMap").data.foreach_set("uv", uvs.ravel())
+
+    # materials of the mesh in the order of first use
+    material_names = [s[2] for s in states]
+    used_materials = []
+    state_material = []
+    for material_name in material_names:
+        if material_name in materials and materials[material_name] not in used_materials:
+            used_materials.append(materials[material_name])
+        state_material.append(used_materials.index(materials[material_name]) if material_name in materials else 0)
+    for material in used_materials:
+        mesh.materials.append(material)
+    if len(used_materials) > 1:
+        mesh.polygons.foreach_set("material_index", np.array(state_material, dtype= np.int32)[face_state])
+
+    # the smooth groups and normals are stored in temporary attributes,
+    # they follow the faces and corners kept by mesh.validate()
+    use_smooth_groups = props.use_smooth_groups and len(face_sizes)
+    if use_smooth_groups:
+        mesh.attributes.new(SMOOTH_GROUP_ATTRIBUTE, 'INT', 'FACE').data.foreach_set("value", smooth_groups)
+    use_normals = len(data.normals) and len(corner_vn) and (corner_vn >= 0).all()
+    if use_normals:
+        normals = data.normals[corner_vn] @ rotation.T
+        lengths = np.linalg.norm(normals, axis= 1, keepdims= True)
+        normals /= np.where(lengths > 0, lengths, 1.0)
+        mesh.attributes.new(NORMAL_ATTRIBUTE, 'FLOAT_VECTOR', 'CORNER').data.foreach_set("vector", normals.ravel())
+
+    mesh.update(calc_edges= True)
+    if mesh.validate(clean_customdata= False):
+        print(f"{name}: invalid geometry was fixed")
+
+    if use_smooth_groups:
+        attribute = mesh.attributes[SMOOTH_GROUP_ATTRIBUTE]
+        smooth_groups = np.zeros(len(mesh.polygons), dtype= np.int32)
+        attribute.data.foreach_get("value", smooth_groups)
+        mesh.attributes.remove(attribute)
+        face_sizes = np.zeros(len(mesh.polygons), dtype= np.int32)
+        mesh.polygons.foreach_get("loop_total", face_sizes)
+        # faces without smooth group are flat, their edges are left alone
+        loop_smooth = np.repeat(np.where(smooth_groups != 0, smooth_groups, -1), face_sizes).astype(np.int32)
+        set_sharp_edges(mesh, loop_smooth)
+
+    if use_normals:
+        attribute = mesh.attributes[NORMAL_ATTRIBUTE]
+        normals = np.zeros(len(mesh.loops) * 3, dtype= np.float32)
+        attribute.data.foreach_get("vector", normals)
+        mesh.attributes.remove(attribute)
+        if bpy.app.version < (4, 1, 0):
+            mesh.use_auto_smooth = True
+        mesh.normals_split_custom_set(normals.reshape(-1, 3))
+    return mesh
+
+
+def add_vertex_groups(ob, data):
+    """Store the OBJ groups as vertex groups, used with Keep Vert Order"""
+    vertex_state = np.full(len(data.positions), -1, dtype= np.int32)
+    vertex_state[data.corner_v] = np.repeat(data.face_state, data.face_sizes)
+    groups = {}
+    for i, (obj_name, group_name, material, smooth) in enumerate(data.states):
+        if group_name:
+            groups.setdefault(group_name, []).append(i)
+    for group_name, state_ids in groups.items():
+        vertices = np.flatnonzero(np.isin(vertex_state, state_ids))
+        if len(vertices):
+            ob.vertex_groups.new(name= group_name).add(vertices.tolist(), 1.0, 'REPLACE')
+
+
+def import_obj(file_path, props, collection, data= None):
+    """Import an OBJ file into the collection, returns the created objects
+
+    data is the result of parse_obj_file when the file was parsed ahead.
+    """
+    if data is None:
+        data = parse_obj_file(file_path, props.use_image_search)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    matrix = get_global_matrix(props, data.positions)
+    materials = create_materials(data)
+
+    objects = []
+    for part_name, face_mask, edge_mask in get_parts(data, props):
+        part_name = part_name or name
+        mesh = build_mesh(part_name, data, props, matrix, materials, face_mask, edge_mask)
+        ob = bpy.data.objects.new(part_name, mesh)
+        collection.objects.link(ob)
+        if props.split_mode == 'OFF' and props.use_groups_as_vgroups:
+            add_vertex_groups(ob, data)
+        objects.append(ob)
+    return objects
+
+
+# ____________________________________________________
+# writer
+
+# Blender Z up to the Y up, -Z forward of the OBJ exporter defaults
+EXPORT_MATRIX = axis_conversion(to_forward= '-Z', to_up= 'Y').to_4x4()
+
+
+class ObjMesh:
+    """Evaluated mesh of an object in OBJ space as flat arrays"""
+
+    def __init__(self, name):
+        self.name = name
+        self.positions = np.zeros((0, 3), dtype= np.float32)
+        # per corner UVs and normals, the UVs are None without UV map
+        self.uvs = None
+        self.normals = np.zeros((0, 3), dtype= np.float32)
+        self.face_sizes = np.zeros(0, dtype= np.int32)
+        self.corner_v = np.zeros(0, dtype= np.int32)
+        self.face_smooth = np.zeros(0, dtype= bool)
+        self.face_material = np.zeros(0, dtype= np.int32)
+        self.material_names = []
+
+
+def get_corner_normals(mesh):
+    """Get the normal of every face corner"""
+    normals = np.empty(len(mesh.loops) * 3, dtype= np.float32)
+    if hasattr(mesh, "corner_normals"):
+        mesh.corner_normals.foreach_get("vector", normals)
+    else:
+        mesh.calc_normals_split()
+        mesh.loops.foreach_get("normal", normals)
+    return normals.reshape(-1, 3)
+
+
+def extract_mesh(ob, depsgraph):
+    """Get the evaluated mesh of an object with its world transform applied"""
+    ob_eval = ob.evaluated_get(depsgraph)
+    mesh = ob_eval.to_mesh()
+    try:
+        data = ObjMesh(ob.name)
+        matrix = np.array(EXPORT_MATRIX @ ob.matrix_world)
+        rotation = matrix[:3, :3]
+
+        co = np.empty(len(mesh.vertices) * 3, dtype= np.float32)
+        mesh.vertices.foreach_get("co", co)
+        data.positions = co.reshape(-1, 3) @ rotation.T + matrix[:3, 3]
+
+        data.corner_v = np.empty(len(mesh.loops), dtype= np.int32)
+        mesh.loops.foreach_get("vertex_index", data.corner_v)
+        data.face_sizes = np.empty(len(mesh.polygons), dtype= np.int32)
+        mesh.polygons.foreach_get("loop_total", data.face_sizes)
+        data.face_smooth = np.empty(len(mesh.polygons), dtype= bool)
+        mesh.polygons.foreach_get("use_smooth", data.face_smooth)
+        data.face_material = np.empty(len(mesh.polygons), dtype= np.int32)
+        mesh.polygons.foreach_get("material_index", data.face_material)
+
+        # normals follow the inverse transpose of the transform
+        normals = get_corner_normals(mesh) @ np.linalg.inv(rotation)
+        lengths = np.linalg.norm(normals, axis= 1, keepdims= True)
+        data.normals = normals / np.where(lengths > 0, lengths, 1.0)
+
+        uv_layer = mesh.uv_layers.active
+        if uv_layer:
+            uvs = np.empty(len(mesh.loops) * 2, dtype= np.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+            data.uvs = uvs.reshape(-1, 2)
+
+        materials = [slot.material for slot in ob_eval.material_slots]
+        data.material_names = [material.name if material else None for material in materials]
+        if materials:
+            np.clip(data.face_material, 0, len(materials) - 1, out= data.face_material)
+    finally:
+        ob_eval.to_mesh_clear()
+    return data, [material for material in materials if material]
+
+
+def get_image_path(image, directory):
+    """Get the texture path written to the MTL, relative when inside the directory"""
+    if image.packed_file or not image.filepath:
+        return None
+    path = os.path.normpath(bpy.path.abspath(image.filepath, library= image.library))
+    relative = os.path.relpath(path, directory)
+    return path if relative.startswith("..") else relative
+
+
+def get_mtl_lines(material, directory):
+    """Get the MTL statements of a material"""
+    wrap = PrincipledBSDFWrapper(material, is_readonly= True)
+    color = wrap.base_color[:3]
+    lines = [
+        f"Ns {(1.0 - wrap.roughness) ** 2 * 1000.0:.6f}",
+        "Ka 1.000000 1.000000 1.000000",
+        "Kd {:.6f} {:.6f} {:.6f}".format(*color),
+        "Ks {0:.6f} {0:.6f} {0:.6f}".format(wrap.specular),
+        f"d {wrap.alpha:.6f}",
+        "illum 2",
+    ]
+    for key, texture in (("map_Kd", wrap.base_color_texture), ("map_Bump", wrap.normalmap_texture),
+            ("map_d", wrap.alpha_texture)):
+        image = texture.image if texture else None
+        path = get_image_path(image, directory) if image else None
+        if path:
+            lines.append(f"{key} {path}")
+    return lines
+
+
+def write_mtl_file(path, materials):
+    """Write the MTL file of materials given as {name: statements}"""
+    with open(path, 'w', encoding= "utf-8") as mtl_file:
+        mtl_file.write(f"# KIT OPS BATCH MTL File\n# Material Count: {len(materials)}\n")
+        for name, lines in materials.items():
+            mtl_file.write(f"\nnewmtl {name}\n")
+            mtl_file.write("".join(line + "\n" for line in lines))
+
+
+def write_faces(obj_file, corners, corner_format, face_sizes):
+    """Write f lines, faces with the same size are written with one format"""
+    if not len(face_sizes):
+        return
+    size = face_sizes[0]
+    if (face_sizes == size).all():
+        line_format = "f " + " ".join([corner_format] * size)
+        np.savetxt(obj_file, corners.reshape(len(face_sizes), -1), fmt= line_format)
+        return
+
+    starts = np.zeros(len(face_sizes) + 1, dtype= np.int64)
+    np.cumsum(face_sizes, out= starts[1:])
+    rows = [corner_format % tuple(corner) for corner in corners.tolist()]
+    obj_file.write("".join("f " + " ".join(rows[a:b]) + "\n" for a, b in zip(starts[:-1], starts[1:])))
+
+
+def write_obj_file(path, meshes, mtl_name= None):
+    """Write meshes to an OBJ file with buffered writes, doesn't use bpy"""
+    with open(path, 'w', encoding= "utf-8", buffering= 1 << 20) as obj_file:
+        obj_file.write("# KIT OPS BATCH OBJ File\n")
+        if mtl_name:
+            obj_file.write(f"mtllib {mtl_name}\n")
+
+        v_offset = vt_offset = vn_offset = 1
+        for mesh in meshes:
+            obj_file.write(f"o {mesh.name}\n")
+            np.savetxt(obj_file, mesh.positions, fmt= "v %.6f %.6f %.6f")
+
+            columns = [mesh.corner_v + v_offset]
+            if mesh.uvs is not None:
+                uvs, uv_index = np.unique(np.round(mesh.uvs, 6), axis= 0, return_inverse= True)
+                np.savetxt(obj_file, uvs, fmt= "vt %.6f %.6f")
+                columns.append(uv_index.ravel() + vt_offset)
+                vt_offset += len(uvs)
+
+            normals, normal_index = np.unique(np.round(mesh.normals, 4), axis= 0, return_inverse= True)
+            np.savetxt(obj_file, normals, fmt= "vn %.4f %.4f %.4f")
+            columns.append(normal_index.ravel() + vn_offset)
+            vn_offset += len(normals)
+            v_offset += len(mesh.positions)
+
+            corners = np.stack(columns, axis= 1)
+            corner_format = "%d/%d/%d" if mesh.uvs is not None else "%d//%d"
+
+            # faces are written in runs sharing the same material and smoothing
+            face_key = mesh.face_material.astype(np.int64) * 2 + mesh.face_smooth
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(face_key)) + 1, [len(face_key)]))
+            loop_starts = np.zeros(len(mesh.face_sizes) + 1, dtype= np.int64)
+            np.cumsum(mesh.face_sizes, out= loop_starts[1:])
+            material = smooth = None
+            for a, b in zip(starts[:-1], starts[1:]):
+                if a == b:
+                    continue
+                names = mesh.material_names
+                name = names[mesh.face_material[a]] if names else None
+                if name and name != material:
+                    obj_file.write(f"usemtl {name}\n")
+                    material = name
+                if mesh.face_smooth[a] != smooth:
+                    smooth = mesh.face_smooth[a]
+                    obj_file.write("s 1\n" if smooth else "s off\n")
+                write_faces(obj_file, corners[loop_starts[a]:loop_starts[b]], corner_format, mesh.face_sizes[a:b])
+
+
+class ObjExport:
+    """Arrays and material statements of one OBJ file, ready to be written"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.meshes = []
+        # {name: MTL statements}
+        self.materials = {}
+
+    @property
+    def nbytes(self):
+        arrays = ("positions", "uvs", "normals", "face_sizes", "corner_v", "face_smooth", "face_material")
+        return sum(getattr(mesh, name).nbytes for mesh in self.meshes for name in arrays
+            if getattr(mesh, name) is not None)
+
+
+def snapshot_obj(file_path, objects, depsgraph):
+    """Get the data of an OBJ file from the mesh objects, on the main thread"""
+    export = ObjExport(file_path)
+    directory = os.path.dirname(file_path)
+    for ob in objects:
+        mesh, mesh_materials = extract_mesh(ob, depsgraph)
+        export.meshes.append(mesh)
+        for material in mesh_materials:
+            if material.name not in export.materials:
+                export.materials[material.name] = get_mtl_lines(material, directory)
+    return export
+
+
+def write_obj_export(export):
+    """Write the OBJ file and its MTL file, doesn't use bpy"""
+    mtl_name = None
+    if export.materials:
+        directory = os.path.dirname(export.file_path)
+        mtl_name = os.path.splitext(os.path.basename(export.file_path))[0] + ".mtl"
+        write_mtl_file(os.path.join(directory, mtl_name), export.materials)
+    write_obj_file(export.file_path, export.meshes, mtl_name)
+
+
+class ObjEmitter:
+    """Write OBJ files on a thread pool
+
+    The snapshots waiting to be written are limited to memory_budget bytes,
+    submit() blocks until enough of them are written. Every file only
+    depends on its own snapshot, the output doesn't depend on the order
+    the threads finish in. Without threads the files are written right away.
+    """
+
+    def __init__(self, threads= 2, memory_budget= 512 * 2**20):
+        self.memory_budget = memory_budget
+        self.executor = ThreadPoolExecutor(max_workers= threads) if threads > 0 else None
+        self.pending = {}
+
+    def wait(self, return_when= FIRST_COMPLETED):
+        """Wait for written files and release their snapshots"""
+        with profiling.stage("obj_write_wait"):
+            done, not_done = wait(self.pending, return_when= return_when)
+        for future in done:
+            del self.pending[future]
+            # raises the error of a failed write
+            future.result()
+
+    def submit(self, export):
+        if self.executor is None:
+            write_obj_export(export)
+            return
+
+        size = export.nbytes
+        while self.pending and sum(self.pending.values()) + size > self.memory_budget:
+            self.wait()
+        self.pending[self.executor.submit(write_obj_export, export)] = size
+
+    def close(self):
+        """Wait for all the files to be written"""
+        if self.executor is None:
+            return
+        try:
+            if self.pending:
+                self.wait(ALL_COMPLETED)
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,8 +2,17 @@ import bpy
 from bpy_extras.io_utils import ImportHelper
 from bl_operators.presets import AddPresetBase
 from .  import utils
+from . import budget
+from . import decalmat
+from . import decaltrim
+from . import geocache
+from . import incremental
+from . import journal
+from . import objio
+from . import profiling
 import os
 import sys
+import time
 
 class OBJECT_OT_load_insert(bpy.types.Operator, ImportHelper):
     """Load INSERT"""
@@ -27,6 +36,7 @@ class OBJECT_OT_load_insert(bpy.types.Operator, ImportHelper):
             props = utils.get_props()
             props.kpack_folder = os.path.dirname(self.filepath)
 
+            utils.flag_existing_data()
             utils.append_all_objects(self, self.filepath)
             props.batch_render_enabled = False
             props.log_file_created = False
@@ -65,6 +75,13 @@ class OBJECT_OT_batch_render_thumbs(bpy.types.Operator):
     bl_label = "Batch Render Thumbs"
     bl_options = {'UNDO'}
 
+    # set by the background workers to process only a part of the folder
+    items_file: bpy.props.StringProperty(
+        name= "Items File",
+        description= "Text file listing the items to process, one per line",
+        options= {'HIDDEN', 'SKIP_SAVE'}
+    )
+
     @classmethod
     def poll(cls, context):
         props = utils.get_props()
@@ -73,20 +90,100 @@ class OBJECT_OT_batch_render_thumbs(bpy.types.Operator):
     def execute(self, context):
         props = utils.get_props()
         kpack_folder = props.kpack_folder
+        profiling.begin(utils.get_prefs().profile_stages)
 
-        blend_files = utils.get_blends(kpack_folder)
-
-        # cleaning up the viewport before batch rendering
+        if self.items_file:
+            blend_files = utils.read_items_file(self.items_file)
+        else:
+            blend_files = utils.get_blends(kpack_folder)
+
+        if props.incremental_render:
+            # settings fingerprint is taken before the camera gets aligned
+            manifest = incremental.load_manifest(kpack_folder, props.log_suffix)
+            fingerprint = incremental.render_fingerprint(context.scene, props)
+            skipped = 0
+
+        journal_path = journal.get_journal_path(kpack_folder, props.log_suffix)
+        if props.resume_render:
+            # skip the finished blends and the ones that keep crashing blender
+            # the main journal first, then the one of this run
+            journal_paths = [journal.get_journal_path(kpack_folder)]
+            if journal_path not in journal_paths:
+                journal_paths.append(journal_path)
+            entries = journal.replay(journal_paths)
+            blend_files, quarantined = journal.get_pending(blend_files, entries, props.max_crashes)
+            for blend in quarantined:
+                print(f"Quarantined after {entries[blend]['crashes']} crashes: {blend}")
+
+        # cleaning up the viewport before batch rendering, everything left
+        # is flagged once so each insert only removes what it appended
         utils.clean_all_imported()
+        utils.flag_existing_data()
+        snapshot = utils.snapshot_datablocks()
+
+        if props.persistent_session:
+            session = utils.begin_render_session(context.scene)
+
+        if props.render_budget:
+            budget_state = budget.apply_render_budget(context.scene, props)
+
+        batch_journal = journal.Journal(journal_path, resume= props.resume_render)
+        for i, blend in enumerate(blend_files):
+            if props.incremental_render:
+                key = os.path.basename(blend)
+                signature = incremental.blend_signature(blend, manifest.get(key))
+                if incremental.is_up_to_date(manifest.get(key), signature, fingerprint, blend):
+                    skipped += 1
+                    batch_journal.record(blend, journal.DONE, skipped= True)
+                    continue
+
+            batch_journal.record(blend, journal.RUNNING)
+            with profiling.item(blend):
+                # what a broken insert leaves behind is found by name
+                item_snapshot = utils.snapshot_datablocks(utils.INSERT_DATA_TYPES)
+                try:
+                    imported = utils.append_all_objects(self, blend)
+                    utils.write_log_entry(kpack_folder, blend)
+                    objects = [block for block in imported if isinstance(block, bpy.types.Object)]
+                    render_start = time.perf_counter()
+                    utils.render_inserts(True, blend, objects)
+                    render_time = time.perf_counter() - render_start
+                except Exception as error:
+                    # one broken insert should not stop the whole batch
+                    print(f"Failed to render {blend}: {error}")
+                    batch_journal.record(blend, journal.FAILED, error= str(error))
+                    utils.remove_datablocks(utils.get_created_datablocks(item_snapshot))
+                    continue
+                utils.remove_datablocks(imported)
+
+            if props.render_budget:
+                batch_journal.record(blend, journal.DONE, seconds= round(render_time, 3),
+                    settings= budget.get_render_settings(context.scene))
+            else:
+                batch_journal.record(blend, journal.DONE, seconds= round(render_time, 3))
+
+            if props.incremental_render:
+                manifest[key] = dict(signature, fingerprint= fingerprint)
+                if i % 25 == 0:
+                    incremental.save_manifest(kpack_folder, manifest, props.log_suffix)
+        batch_journal.close()
+
+        if props.incremental_render:
+            incremental.save_manifest(kpack_folder, manifest, props.log_suffix)
+            print(f"Skipped {skipped} up-to-date thumbnails")
 
-        for blend in blend_files:
-            utils.append_all_objects(self, blend)
-            utils.write_log_entry(kpack_folder, blend)
-            utils.render_inserts(True, blend)
-            utils.clean_all_imported()
+        if props.render_budget:
+            budget.restore_render_settings(budget_state)
 
         props.log_file_created = True
-        utils.purge_orphan_data()
+        if props.persistent_session:
+            # every insert already removed its own data, the rest of the
+            # scene stays loaded for the next batch
+            utils.end_render_session(context.scene, session)
+        else:
+            # every insert removed its own data, only look at what is left of the batch
+            utils.purge_new_orphans(snapshot)
+        profiling.finish(utils.get_profile_path(kpack_folder))
         print ("Batch render thumbs")
         return {'FINISHED'}
 
@@ -205,6 +302,13 @@ class OBJECT_OT_batch_convert_to_blend(bpy.types.Operator):
     bl_label = "Batch Convert to .blend"
     # bl_options = {'PRESET'}
 
+    # set by the background workers to process only a part of the folder
+    items_file: bpy.props.StringProperty(
+        name= "Items File",
+        description= "Text file listing the items to process, one per line",
+        options= {'HIDDEN', 'SKIP_SAVE'}
+    )
+
     @classmethod
     def poll(cls, context):
         props = utils.get_props()
@@ -232,41 +336,60 @@ class OBJECT_OT_batch_convert_to_blend(bpy.types.Operator):
         create_insert = props.create_insert
         center_n_set = props.center_n_set
         clear_split_normals = props.clear_split_normals
+        sharp_angle = props.sharp_angle if props.sharp_by_angle else None
         prefs = bpy.context.preferences.addons['kitops-batch'].preferences
+        profiling.begin(prefs.profile_stages)
 
         # flag all existing objects to keep them when cleanup is performed
         for ob in bpy.data.objects:
             ob.keep_object = True
 
+        snapshot = utils.snapshot_datablocks()
         new_scene = utils.copy_scene()
         new_scene.name = "Export"
 
         # import the objs
-        objs = utils.get_objs(objs_folder)
+        if self.items_file:
+            objs = utils.read_items_file(self.items_file)
+        else:
+            objs = utils.get_objs(objs_folder)
         if objs:
+            purge = utils.get_deferred_purge()
+            dedup = utils.Deduplicator(props.deduplicate)
             # imported_objects = []
             # if the directory contains OBJ files
-            for ob in objs:
-                imported_objects = utils.import_obj(ob)
-
-                # apply transforms, assign origin to center bottom and reset transforms
-                for ob in imported_objects:
-                    print(ob.name)
-                    ob.scale *= prefs.obj_default_scale
-                    bpy.context.view_layer.update()
-                    utils.apply_transforms(ob)
-                    bpy.context.view_layer.update()
-                    utils.origin_to_bottom(ob, center_n_set)
-                    bpy.context.view_layer.update()
-                    utils.reset_transforms(ob, center_n_set)
-                    bpy.context.view_layer.update()
-                    utils.clear_custom_split_normals(ob, clear_split_normals)
-
-                    blend = utils.create_blend(objs_folder, ob, new_scene, self, create_insert)
+            paths = [os.path.join(objs_folder, ob) for ob in objs]
+            if props.obj_reader == 'BUILTIN':
+                # the built-in reader parses the next files while the current one is written
+                cache = geocache.get_cache(prefs) if props.geometry_cache else None
+                parsed = objio.iter_parsed(paths, props.obj_lookahead, props.use_image_search, cache)
+            else:
+                parsed = ((path, None) for path in paths)
+            for path, data in parsed:
+                ob = os.path.basename(path)
+                with profiling.item(ob):
+                    imported_objects = utils.import_obj(ob, data)
+
+                    # apply transforms, assign origin to center bottom and reset transforms
+                    with profiling.stage("transforms"):
+                        utils.normalise_objects(imported_objects, prefs.obj_default_scale, center_n_set)
+
+                    utils.clear_custom_split_normals(imported_objects, clear_split_normals, sharp_angle)
+
+                    for ob in imported_objects:
+                        print(ob.name)
+                        if dedup.find([ob], f"{ob.name}.blend"):
+                            utils.discard_objects([ob], purge= purge)
+                            continue
+
+                        blend = utils.create_blend(objs_folder, ob, new_scene, self, create_insert, purge= purge)
 
             # after exporting all objs delete the scene and perform a cleanup
+            dedup.write_report(objs_folder)
+            purge.flush()
             bpy.data.scenes.remove(new_scene)
-            utils.purge_orphan_data()
+            utils.purge_new_orphans(snapshot)
+            profiling.finish(utils.get_profile_path(objs_folder))
         else:
             self.report(type= {'ERROR'}, message="No OBJ files found")
 
@@ -295,10 +418,15 @@ class OBJECT_OT_batch_convert_to_obj(bpy.types.Operator):
             else:
                 export_list = bpy.context.scene.collection.children
 
+            prefs = utils.get_prefs()
+            profiling.begin(prefs.profile_stages)
             if export_list:
                 # if the export list is not empty
-                for item in export_list:
-                    utils.export_to_obj(item, export_dir)
+                with objio.ObjEmitter(props.obj_write_threads, prefs.obj_write_memory * 2**20) as emitter:
+                    for item in export_list:
+                        with profiling.item(item.name), profiling.stage("obj_export"):
+                            utils.export_to_obj(item, export_dir, emitter)
+            profiling.finish(utils.get_profile_path(export_dir))
 
             print ("Batch converted to OBJs")
         else:
@@ -311,6 +439,13 @@ class OBJECT_OT_batch_convert_images(bpy.types.Operator):
     bl_label = "Batch Convert"
     # bl_options = {'UNDO'}
 
+    # set by the background workers to process only a part of the folder
+    items_file: bpy.props.StringProperty(
+        name= "Items File",
+        description= "Text file listing the items to process, one per line",
+        options= {'HIDDEN', 'SKIP_SAVE'}
+    )
+
     @classmethod
     def poll(cls, context):
         props = utils.get_props()
@@ -321,49 +456,88 @@ class OBJECT_OT_batch_convert_images(bpy.types.Operator):
         props = utils.get_props()
         images_folder = props.images_folder
         decal_temp_file = props.decal_temp_file
+        profiling.begin(utils.get_prefs().profile_stages)
         decal_mat_name = "Batch DECAL"
         decal_object_name = "Batch DECAL"
-        images = utils.get_pngs(images_folder)
+        if self.items_file:
+            images = utils.read_items_file(self.items_file)
+        else:
+            images = utils.get_pngs(images_folder)
 
         # create a new export scene
+        snapshot = utils.snapshot_datablocks()
         new_scene = utils.copy_scene()
         new_scene.name = "Export"
 
         # load the decals material from the blend file
         utils.load_decal_mat(decal_temp_file, decal_mat_name)
+        library_path = None
+        if props.decal_material == 'SHARED':
+            library_path = decalmat.get_library_path(images_folder, decal_temp_file)
+            decal_mat_name = decalmat.make_shared_material(decal_mat_name, library_path)
         utils.load_decal_mod(decal_temp_file, decal_object_name)
         decal_template_ob = bpy.data.objects.get(decal_object_name)
         decal_modifiers = decal_template_ob.modifiers
 
-        decal_objects = []
-        for img in images:
-            image_path = os.path.join(images_folder, img)
-            bpy.data.images.load(image_path, check_existing= True)
-            image = bpy.data.images.get(img)
-            img_size = image.size
-            decal_ob = utils.create_decal(img, img_size, decal_mat_name)
-            utils.add_modifiers(decal_ob, decal_modifiers)
-            decal_objects.append(decal_ob)
-
         # create log file
         utils.create_log_file(images_folder)
 
-        for ob in decal_objects:
-            # deactivating some cycles visibility options
-            ob.cycles_visibility.glossy = False
-            ob.cycles_visibility.shadow = False
-            ob.cycles_visibility.diffuse = False
-            
-            blend = utils.create_blend(images_folder, ob, new_scene, self)
-            utils.write_log_entry(images_folder, blend)
-
-        # after exporting all objs delete the scene and perform a cleanup
+        images_path = bpy.path.abspath(images_folder)
+        decals = []
+        for img in images:
+            image_path = os.path.join(images_path, img)
+            with profiling.stage("image_probe"):
+                info = utils.read_png_info(image_path)
+            if info is None:
+                print(f"{img} is not a valid PNG image, skipped")
+                continue
+            if not info["alpha"]:
+                print(f"{img} has no alpha channel")
+            decals.append((img, (info["width"], info["height"]), image_path, info["alpha"]))
+
+        # the planes are built in batches, the images of a batch are
+        # removed together with their decals once exported
+        for start in range(0, len(decals), utils.DECAL_BATCH_SIZE):
+            batch = []
+            for img, size, path, alpha in decals[start:start + utils.DECAL_BATCH_SIZE]:
+                # the pixels are only decoded when something reads them
+                image = bpy.data.images.load(path, check_existing= True)
+                outline = None
+                if props.decal_trim != 'NONE' and alpha:
+                    # one image is decoded at a time, its pixels are freed by the trim
+                    with profiling.stage("decal_trim"):
+                        image, size, outline = decaltrim.trim_decal(image, path, props.decal_trim,
+                            props.decal_cutout, props.decal_alpha_threshold)
+                batch.append((img, size, image, outline))
+            decal_objects = utils.create_decals(batch, decal_mat_name, new_scene.collection)
+
+            for (img, size, image, outline), ob in zip(batch, decal_objects):
+                with profiling.item(img):
+                    levels = props.decal_max_subdiv
+                    if props.decal_adaptive_subdiv:
+                        levels = utils.get_subsurf_levels(size, outline, props.decal_subdiv_edge, levels)
+                    utils.add_modifiers(ob, decal_modifiers, levels)
+                    if props.decal_bake_modifiers:
+                        utils.bake_modifiers(ob)
+
+                    # deactivating some cycles visibility options
+                    ob.cycles_visibility.glossy = False
+                    ob.cycles_visibility.shadow = False
+                    ob.cycles_visibility.diffuse = False
+
+                    blend = utils.create_blend(images_folder, ob, new_scene, self)
+                    utils.write_log_entry(images_folder, blend)
+
+        # after exporting all objs delete the scene and remove the templates
         bpy.data.scenes.remove(new_scene)
-        utils.purge_orphan_data()
+        utils.purge_new_orphans(snapshot)
+        if library_path:
+            decalmat.remove_library(library_path)
 
         # set the property to True to enable the view log button
         props.log_file_created = True
 
+        profiling.finish(utils.get_profile_path(images_folder))
         print("Batch converted images")
         return {'FINISHED'} 
 
@@ -376,6 +550,16 @@ class OBJECT_OT_help(bpy.types.Operator):
         bpy.ops.wm.url_open(url= "https://docs.google.com/document/d/1J0gDERPU3SZCRsqoASGu4qlgz9lJMDto64ChnmwQJcE/edit")
         return {'FINISHED'}
 
+class OBJECT_OT_clear_geometry_cache(bpy.types.Operator):
+    """Remove all the cached OBJ geometry"""
+    bl_idname = "kob.clear_geometry_cache"
+    bl_label = "Clear Geometry Cache"
+
+    def execute(self, context):
+        geocache.get_cache(utils.get_prefs()).clear()
+        self.report(type= {'INFO'}, message= "Geometry cache cleared")
+        return {'FINISHED'}
+
 class OBJECT_OT_view_log_images(bpy.types.Operator):
     """View Log for Converted Images"""
     bl_idname = "kob.view_log_images"
@@ -413,6 +597,7 @@ class OBJECT_OT_batch_export_blend(bpy.types.Operator):
         create_insert = props.create_insert
         center_n_set = props.center_n_set
         clear_split_normals = props.clear_split_normals
+        sharp_angle = props.sharp_angle if props.sharp_by_angle else None
         prefs = bpy.context.preferences.addons['kitops-batch'].preferences
 
         
@@ -428,22 +613,35 @@ class OBJECT_OT_batch_export_blend(bpy.types.Operator):
             # this function works only for mesh objects with no parents
             to_export = [ob for ob in bpy.data.scenes[original_scene_name].objects if ob.type == 'MESH' and not ob.parent]
 
+            profiling.begin(prefs.profile_stages)
+            purge = utils.get_deferred_purge()
+            dedup = utils.Deduplicator(props.deduplicate)
             for ob in to_export:
                 print(ob.name)
                 children = list(ob.children)
                 objects_group = [ob] + children
-                for ob_ in objects_group:
-                    bpy.context.collection.objects.link(ob_)
-                    utils.apply_transforms(ob_)
-                    bpy.context.view_layer.update()
-                    utils.origin_to_bottom(ob_, center_n_set)
-                    bpy.context.view_layer.update()
-                    utils.reset_transforms(ob_, center_n_set)
-                    bpy.context.view_layer.update()
-                    utils.clear_custom_split_normals(ob_, clear_split_normals)
-                
-                blend = utils.create_blend(directory, ob, new_scene, self, create_insert= create_insert, children= children)
+                blend_name = f"{ob.name}.blend"
+                with profiling.item(ob.name):
+                    # objects sharing the meshes of an exported object are
+                    # found before the transforms change the shared meshes
+                    if dedup.enabled and dedup.find(objects_group, blend_name, utils.get_mesh_key(objects_group, center_n_set)):
+                        utils.discard_objects(objects_group, purge= purge)
+                        continue
+
+                    for ob_ in objects_group:
+                        bpy.context.collection.objects.link(ob_)
+                    with profiling.stage("transforms"):
+                        utils.normalise_objects(objects_group, center_n_set= center_n_set)
+                    utils.clear_custom_split_normals(objects_group, clear_split_normals, sharp_angle)
+                    if dedup.find(objects_group, blend_name):
+                        utils.discard_objects(objects_group, purge= purge)
+                        continue
+
+                    blend = utils.create_blend(directory, ob, new_scene, self, create_insert= create_insert, children= children, purge= purge)
+            dedup.write_report(directory)
+            purge.flush()
             bpy.data.scenes.remove(new_scene)
+            profiling.finish(utils.get_profile_path(directory))
 
         else:
             self.report(type= {'ERROR'}, message= "Please save current blend file first")
@@ -465,6 +663,7 @@ classes = (
     OBJECT_OT_batch_convert_to_obj,
     OBJECT_OT_batch_convert_images,
     OBJECT_OT_help,
+    OBJECT_OT_clear_geometry_cache,
     OBJECT_OT_view_log_images,
     OBJECT_OT_batch_export_blend
 )
@@ -0,0 +1,140 @@
+"""Run a batch pipeline on several background Blender workers
+
+The coordinator splits the list of items (INSERT blends, OBJ files or PNG
+images) into shards, starts one background Blender per shard through
+cli.py and merges the workers log files back into the main log file.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def get_cpu_count():
+    """Get the number of CPUs available to this process"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_shards(items, count):
+    """Split items into count interleaved shards, empty shards are dropped"""
+    # interleaving spreads similar neighbouring files over all workers
+    shards = [items[i::count] for i in range(count)]
+    return [shard for shard in shards if shard]
+
+
+def get_threads_per_worker(workers):
+    """Render threads for each worker so the workers don't oversubscribe the CPU"""
+    return max(1, get_cpu_count() // max(1, workers))
+
+
+def shard_suffix(index):
+    """Log file suffix of a worker"""
+    return f".shard{index:02d}"
+
+
+def strip_option(argv, name):
+    """Remove an option and its value from a list of arguments"""
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(name + "="):
+            args.append(arg)
+    return args
+
+
+def write_items_file(path, items):
+    """Write the items of a shard, one per line"""
+    with open(path, 'w') as items_file:
+        for item in items:
+            items_file.write(f"{item}\n")
+
+
+def worker_command(binary_path, blend_file, script_path, command_args, items_file, suffix, threads):
+    """Build the command line of one background worker"""
+    cmd = [binary_path, "-b"]
+    if blend_file:
+        cmd.append(blend_file)
+    cmd += ["-P", script_path, "--"]
+    cmd += command_args
+    cmd += ["--items-file", items_file, "--log-suffix", suffix, "--render-threads", str(threads)]
+    return cmd
+
+
+def read_tail(path, lines= 20):
+    """Get the last lines of a worker output file"""
+    with open(path, errors= 'replace') as output:
+        return "".join(output.readlines()[-lines:])
+
+
+def create_work_dir():
+    """Create the temporary directory of the shard lists and worker outputs"""
+    return tempfile.mkdtemp(prefix= "kob_pool_")
+
+
+def remove_work_dir(work_dir):
+    """Remove the temporary directory of a run"""
+    shutil.rmtree(work_dir, ignore_errors= True)
+
+
+def run_workers(binary_path, blend_file, script_path, command_args, items, workers, work_dir= None):
+    """Run the command on shards of items in parallel background Blenders
+
+    Returns a list of (suffix, return code) tuples, one for each worker.
+    """
+    shards = split_shards(items, workers)
+    threads = get_threads_per_worker(len(shards))
+    own_work_dir = work_dir is None
+    work_dir = work_dir or create_work_dir()
+
+    try:
+        processes = []
+        for index, shard in enumerate(shards):
+            suffix = shard_suffix(index)
+            items_file = os.path.join(work_dir, f"items{suffix}.txt")
+            write_items_file(items_file, shard)
+
+            cmd = worker_command(binary_path, blend_file, script_path, command_args, items_file, suffix, threads)
+            output = open(os.path.join(work_dir, f"worker{suffix}.log"), 'w')
+            print(f"Starting worker {index} with {len(shard)} items")
+            processes.append((suffix, subprocess.Popen(cmd, stdout= output, stderr= subprocess.STDOUT), output))
+
+        results = []
+        for suffix, process, output in processes:
+            return_code = process.wait()
+            output.close()
+            if return_code != 0:
+                # the work directory is removed after the run, keep the end of the output
+                print(f"Worker{suffix} failed with code {return_code}:")
+                print(read_tail(output.name))
+            results.append((suffix, return_code))
+    finally:
+        if own_work_dir:
+            remove_work_dir(work_dir)
+
+    return results
+
+
+def merge_logs(log_file_path, suffixes, items):
+    """Append the workers log entries to the main log file in the items order"""
+    order = {os.path.splitext(os.path.basename(item))[0]: i for i, item in enumerate(items)}
+    root, ext = os.path.splitext(log_file_path)
+
+    entries = []
+    for suffix in suffixes:
+        shard_log = root + suffix + ext
+        if not os.path.exists(shard_log):
+            continue
+        with open(shard_log) as log:
+            entries += [line.rstrip("\n") for line in log if line.strip()]
+        os.remove(shard_log)
+
+    entries.sort(key= lambda entry: order.get(os.path.splitext(os.path.basename(entry))[0], len(order)))
+    with open(log_file_path, 'a') as log:
+        for entry in entries:
+            log.write(f"{entry}\n")
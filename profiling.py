@@ -0,0 +1,203 @@
+"""Optional stage timing for the batch operators
+
+Stages are timed with the stage() context manager, grouped per processed
+item with item(). When profiling is disabled both are no-ops. A stage
+only counts its self time, the time of the stages nested inside it goes
+to those, so the stage totals add up to the profiled time. The report
+holds per item timings, the samples and p50/p95/max/count/total of every
+stage and the peak memory of the process.
+"""
+import functools
+import json
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class Profiler:
+    """Collect stage timings of one batch"""
+
+    def __init__(self, enabled= False):
+        self.enabled = enabled
+        self.items = []
+        self.stages = {}
+        self.current = None
+        # time spent in nested stages, one entry per running stage
+        self.nested = []
+        self.start_time = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.stages.setdefault(name, []).append(seconds)
+        if self.current is not None:
+            stages = self.current["stages"]
+            stages[name] = stages.get(name, 0.0) + seconds
+
+
+profiler = Profiler()
+
+
+def begin(enabled):
+    """Start profiling a new batch"""
+    global profiler
+    profiler = Profiler(enabled)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the batch"""
+    if not profiler.enabled:
+        yield
+        return
+    profiler.nested.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        nested = profiler.nested.pop()
+        if profiler.nested:
+            profiler.nested[-1] += seconds
+        profiler.add(name, seconds - nested)
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def item(name):
+    """Group the stages timed inside into one processed item"""
+    if not profiler.enabled:
+        yield
+        return
+    profiler.current = {"item": name, "stages": {}}
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.current["seconds"] = time.perf_counter() - start
+        profiler.items.append(profiler.current)
+        profiler.current = None
+
+
+def get_peak_memory():
+    """Get the peak resident memory of the process in bytes, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_memory():
+    """Get the current resident memory of the process in bytes, None if unknown"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return get_peak_memory()
+
+
+def percentile(values, q):
+    """Get the q percentile of a list of values, nearest rank"""
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(stages):
+    """Get the aggregate statistics of every stage"""
+    summary = {}
+    for name, values in stages.items():
+        summary[name] = {
+            "count": len(values),
+            "total": sum(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+        }
+    return summary
+
+
+def get_report():
+    """Get the report of the current batch"""
+    return {
+        "wall_time": time.perf_counter() - profiler.start_time,
+        "peak_memory": get_peak_memory(),
+        "stages": summarize(profiler.stages),
+        "samples": profiler.stages,
+        "items": profiler.items,
+    }
+
+
+def format_report(report):
+    """Format the aggregate part of a report as a text table"""
+    lines = [f"{'stage':<16}{'count':>8}{'total':>10}{'p50':>10}{'p95':>10}{'max':>10}"]
+    for name, stats in sorted(report["stages"].items(), key= lambda stage: -stage[1]["total"]):
+        lines.append(f"{name:<16}{stats['count']:>8}{stats['total']:>10.3f}"
+            f"{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['max']:>10.3f}")
+    lines.append(f"items: {len(report['items'])}  wall time: {report['wall_time']:.3f}s")
+    if report["peak_memory"]:
+        lines.append(f"peak memory: {report['peak_memory'] / 2**20:.1f} MB")
+    return "\n".join(lines)
+
+
+def finish(report_path):
+    """Print the report and write it to a JSON file, if profiling is enabled"""
+    if not profiler.enabled:
+        return None
+    report = get_report()
+    print(format_report(report))
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent= 1)
+    return report
+
+
+def merge_reports(report_paths, report_path, wall_time):
+    """Merge the reports written by several workers into one report
+
+    The stage samples of the workers are merged, including the stages
+    timed outside of the items.
+    """
+    stages = {}
+    items = []
+    peaks = []
+    for path in report_paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as report_file:
+            report = json.load(report_file)
+        os.remove(path)
+
+        items += report["items"]
+        if report["peak_memory"]:
+            peaks.append(report["peak_memory"])
+        for name, samples in report["samples"].items():
+            stages.setdefault(name, []).extend(samples)
+
+    report = {
+        "wall_time": wall_time,
+        "peak_memory": max(peaks) if peaks else None,
+        "stages": summarize(stages),
+        "samples": stages,
+        "items": items,
+    }
+    print(format_report(report))
+    with open(report_path, 'w') as report_file:
+        json.dump(report, report_file, indent= 1)
+    return report
@@ -1,6 +1,7 @@
 import bpy
 from mathutils import Matrix
 from .utils import get_props
+import math
 import os
 
 def get_ca_pa(self):
@@ -73,6 +74,47 @@ class KOBPreferences(bpy.types.AddonPreferences):
         default= False
         )
 
+    profile_stages: bpy.props.BoolProperty(
+        name= "Profile batch stages",
+        description= "Time every batch stage and write a report next to the log file",
+        default= False
+    )
+
+    purge_interval: bpy.props.IntProperty(
+        name= "Purge interval",
+        description= "Remove the data left by the exported objects every N items",
+        default= 25,
+        min= 1
+    )
+
+    purge_memory_limit: bpy.props.IntProperty(
+        name= "Purge memory limit (MB)",
+        description= "Remove the data left by the exported objects as soon as Blender uses more memory, 0 to disable",
+        default= 0,
+        min= 0
+    )
+
+    geometry_cache_folder: bpy.props.StringProperty(
+        name= "Geometry cache folder",
+        description= "Folder of the parsed OBJ geometry cache, the system temporary folder when empty",
+        subtype= 'DIR_PATH',
+        default= ""
+    )
+
+    geometry_cache_size: bpy.props.IntProperty(
+        name= "Geometry cache size (MB)",
+        description= "The least recently used geometry is removed above this size",
+        default= 2048,
+        min= 1
+    )
+
+    obj_write_memory: bpy.props.IntProperty(
+        name= "OBJ writer memory (MB)",
+        description= "Memory of the mesh data waiting to be written by the OBJ writer threads",
+        default= 512,
+        min= 1
+    )
+
     obj_default_scale: bpy.props.FloatProperty(
         name= "Exported OBJ default scale",
         description= "Default value for exported OBJs scale",
@@ -101,6 +143,15 @@ class KOBPreferences(bpy.types.AddonPreferences):
         col = layout.column()
         col.prop(self, "obj_default_scale")
         col.prop(self, "blend_export_enabled")
+        col.prop(self, "profile_stages")
+        row = col.row()
+        row.prop(self, "purge_interval")
+        row.prop(self, "purge_memory_limit")
+        col.prop(self, "obj_write_memory")
+        col.prop(self, "geometry_cache_folder")
+        row = col.row()
+        row.prop(self, "geometry_cache_size")
+        row.operator("kob.clear_geometry_cache")
 
 
 class KOBProps(bpy.types.PropertyGroup):
@@ -122,6 +173,11 @@ class KOBProps(bpy.types.PropertyGroup):
         default= False
     )
 
+    # used by the background workers to write to their own log file
+    log_suffix: bpy.props.StringProperty(
+        default= ""
+    )
+
     batch_render_enabled: bpy.props.BoolProperty(
         default= False
     )
@@ -132,6 +188,23 @@ class KOBProps(bpy.types.PropertyGroup):
         default= True
     )
 
+    fast_append: bpy.props.BoolProperty(
+        name= "Fast INSERT append",
+        description= "Append INSERTS at the data level instead of using the KIT OPS operator, works in background mode",
+        default= False
+    )
+
+    camera_framing: bpy.props.EnumProperty(
+        name= "Camera framing",
+        description= "How the camera is fitted to the INSERT, the camera orientation is kept",
+        items=[
+            ("VIEW", "View Selected", "Use the 3D View operator on the selected INSERT, needs a window"),
+            ("BOUNDS", "Bounding Box", "Fit the bounding boxes of the INSERT objects"),
+            ("TIGHT", "Tight", "Fit the evaluated vertices of the INSERT objects")
+        ],
+        default='VIEW'
+    )
+
     camera_padding: bpy.props.FloatProperty(
         name= "Camera padding",
         default= 0.0,
@@ -141,6 +214,91 @@ class KOBProps(bpy.types.PropertyGroup):
         set= set_ca_pa
     )
 
+    persistent_session: bpy.props.BoolProperty(
+        name= "Persistent render session",
+        description= "Keep the render scene data loaded between thumbnails, only the INSERT is swapped",
+        default= False
+    )
+
+    incremental_render: bpy.props.BoolProperty(
+        name= "Skip up-to-date thumbnails",
+        description= "Only render INSERTS whose blend file or render settings changed since the last batch",
+        default= False
+    )
+
+    resume_render: bpy.props.BoolProperty(
+        name= "Resume interrupted batch",
+        description= "Continue the last batch from its journal, skipping the finished INSERTS",
+        default= False
+    )
+
+    max_crashes: bpy.props.IntProperty(
+        name= "Quarantine after crashes",
+        description= "Skip an INSERT on resume once it crashed blender this many times",
+        default= 2,
+        min= 1
+    )
+
+    render_budget: bpy.props.BoolProperty(
+        name= "Render budget",
+        description= "Cap the samples and render time of every thumbnail",
+        default= False
+    )
+
+    budget_max_samples: bpy.props.IntProperty(
+        name= "Max Samples",
+        description= "Upper limit for the render samples of a thumbnail",
+        default= 128,
+        min= 1
+    )
+
+    budget_noise_threshold: bpy.props.FloatProperty(
+        name= "Noise Threshold",
+        description= "Cycles adaptive sampling noise threshold",
+        default= 0.05,
+        min= 0.001,
+        max= 1.0
+    )
+
+    budget_time_limit: bpy.props.FloatProperty(
+        name= "Time Limit",
+        description= "Maximum render time of a thumbnail in seconds, 0 for no limit (Cycles 3.0 and newer)",
+        default= 30.0,
+        min= 0.0
+    )
+
+    budget_denoise: bpy.props.BoolProperty(
+        name= "Denoise",
+        description= "Denoise the thumbnails to get away with less samples",
+        default= True
+    )
+
+    budget_texture_limit: bpy.props.EnumProperty(
+        name= "Texture Limit",
+        description= "Limit the texture size used for rendering through simplify",
+        items=[
+            ("OFF", "No Limit", ""),
+            ("128", "128", ""),
+            ("256", "256", ""),
+            ("512", "512", ""),
+            ("1024", "1024", ""),
+            ("2048", "2048", ""),
+            ("4096", "4096", "")
+        ],
+        default='1024'
+    )
+
+    budget_draft_engine: bpy.props.EnumProperty(
+        name= "Draft Engine",
+        description= "Render the thumbnails with a cheaper engine than the render scene",
+        items=[
+            ("NONE", "Scene Engine", "Use the render engine of the render scene"),
+            ("EEVEE", "EEVEE", "Render draft thumbnails with EEVEE"),
+            ("WORKBENCH", "Workbench", "Render draft thumbnails with Workbench")
+        ],
+        default='NONE'
+    )
+
     obj_folder: bpy.props.StringProperty(
         name= "OBJ files folder",
         subtype= 'DIR_PATH'
@@ -161,6 +319,44 @@ class KOBProps(bpy.types.PropertyGroup):
         default= True
     )
 
+    deduplicate: bpy.props.BoolProperty(
+        name= "Skip duplicate geometry",
+        description= "Don't write the blends with the same geometry as an already written one, the duplicates are listed in a report next to the log file",
+        default= False
+    )
+
+    sharp_by_angle: bpy.props.BoolProperty(
+        name= "Sharp edges by angle",
+        description= "Smooth shade the cleared meshes and mark the edges above the angle as sharp",
+        default= False
+    )
+
+    sharp_angle: bpy.props.FloatProperty(
+        name= "Angle",
+        subtype= 'ANGLE',
+        default= math.radians(30.0),
+        min= 0.0,
+        max= math.pi
+    )
+
+    obj_writer: bpy.props.EnumProperty(
+        name= "Writer",
+        description= "How the OBJ files are written",
+        items=[
+            ("BUILTIN", "Built-in", "Fast writer of the addon, reads the mesh data directly"),
+            ("BLENDER", "Blender", "OBJ exporter of Blender, selects every exported object")
+        ],
+        default='BLENDER'
+    )
+
+    obj_write_threads: bpy.props.IntProperty(
+        name= "Writer threads",
+        description= "Threads writing the OBJ files of the built-in writer, 0 writes them one after the other",
+        default= 2,
+        min= 0,
+        max= 32
+    )
+
     convert_mode: bpy.props.EnumProperty(
         items=[
             ("0", "Collections", "Collections", '', 0),
@@ -186,7 +382,91 @@ class KOBProps(bpy.types.PropertyGroup):
         default= os.path.join(os.path.dirname(os.path.realpath(__file__)), "decaltemplates", "")
     )
 
+    decal_material: bpy.props.EnumProperty(
+        name= "Material",
+        description= "How the decals get the template material",
+        items=[
+            ("COPY", "Copy", "Every decal gets a full copy of the template material"),
+            ("SHARED", "Shared", "Every decal gets a thin material with its image around a node group linked from a shader blend next to the decals")
+        ],
+        default='COPY'
+    )
+
+    decal_trim: bpy.props.EnumProperty(
+        name= "Trim",
+        description= "Size the decals to the opaque part of the images",
+        items=[
+            ("NONE", "None", "Use the whole image"),
+            ("UV", "UV", "Map the opaque part of the original image"),
+            ("CROP", "Crop", "Write a cropped copy of the image to a trimmed folder next to the images")
+        ],
+        default='NONE'
+    )
+
+    decal_cutout: bpy.props.BoolProperty(
+        name= "Cut-out",
+        description= "Shape the trimmed decals after the outline of the opaque pixels",
+        default= False
+    )
+
+    decal_alpha_threshold: bpy.props.FloatProperty(
+        name= "Alpha Threshold",
+        description= "Pixels with a lower alpha are transparent for the trim",
+        min= 0.0,
+        max= 1.0,
+        default= 0.01
+    )
+
+    decal_adaptive_subdiv: bpy.props.BoolProperty(
+        name= "Adaptive Subdivision",
+        description= "Choose the subdivision levels of every decal from its size",
+        default= False
+    )
+
+    decal_max_subdiv: bpy.props.IntProperty(
+        name= "Max Levels",
+        description= "Subdivision levels of the largest decals",
+        min= 0,
+        max= 6,
+        default= 3
+    )
+
+    decal_subdiv_edge: bpy.props.FloatProperty(
+        name= "Edge Length",
+        description= "Length of the subdivided faces the levels are chosen for",
+        subtype= 'DISTANCE',
+        min= 0.001,
+        default= 0.064
+    )
+
+    decal_bake_modifiers: bpy.props.BoolProperty(
+        name= "Bake Modifiers",
+        description= "Apply the modifiers before the shrinkwrap to the decal meshes",
+        default= False
+    )
+
     # some properties for the object export
+    obj_reader: bpy.props.EnumProperty(
+        name= "Reader",
+        description= "How the OBJ files are read",
+        items=[
+            ("BUILTIN", "Built-in", "Fast reader of the addon, builds the meshes directly"),
+            ("BLENDER", "Blender", "OBJ importer of Blender")
+        ],
+        default='BLENDER'
+    )
+    geometry_cache: bpy.props.BoolProperty(
+        name= "Geometry cache",
+        description= "Keep the parsed geometry on disk, converting the same OBJ files again skips parsing",
+        default= False
+    )
+    obj_lookahead: bpy.props.IntProperty(
+        name= "Look-ahead",
+        description= "Number of OBJ files parsed in the background while the current one is converted, 0 to disable",
+        default= 2,
+        min= 0,
+        max= 16
+    )
     use_edges: bpy.props.BoolProperty(name= "Lines", default= False)
     use_smooth_groups: bpy.props.BoolProperty(name= "Smooth Groups", default= False)
     use_split_objects: bpy.props.BoolProperty(name= "Split by Object", default= False)
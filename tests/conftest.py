@@ -0,0 +1,19 @@
+"""Import the pure Python modules of the add-on outside of Blender
+
+Blender modules are replaced by mocks and the add-on folder is imported as
+the "kob" package without running its __init__, so nothing is registered.
+"""
+import os
+import sys
+import types
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for name in ("bpy", "bmesh", "mathutils", "bpy_extras", "bpy_extras.io_utils", "bpy_extras.node_shader_utils"):
+    sys.modules.setdefault(name, mock.MagicMock(name= name))
+sys.modules["bpy"].path.abspath = lambda path: path
+
+package = types.ModuleType("kob")
+package.__path__ = [ROOT]
+sys.modules.setdefault("kob", package)
@@ -0,0 +1,56 @@
+from unittest import mock
+
+import numpy as np
+
+from kob import decaltrim
+
+
+def test_convex_hull():
+    points = np.array(((0, 0), (2, 0), (1, 1), (2, 2), (0, 2), (1, 0), (0, 0)))
+    hull = decaltrim.convex_hull(points)
+    assert hull.tolist() == [[0, 0], [2, 0], [2, 2], [0, 2]]
+
+
+def test_get_opaque_box():
+    mask = np.zeros((20, 30), dtype= bool)
+    mask[5:10, 8:12] = True
+    assert decaltrim.get_opaque_box(mask) == (6, 3, 14, 12)
+    assert decaltrim.get_opaque_box(mask, margin= 0) == (8, 5, 12, 10)
+    assert decaltrim.get_opaque_box(np.zeros((4, 4), dtype= bool)) is None
+
+
+def test_get_outline_of_a_triangle():
+    size = 64
+    y, x = np.mgrid[:size, :size]
+    mask = x <= y
+    box = decaltrim.get_opaque_box(mask, margin= 0)
+    outline = decaltrim.get_outline(mask, box)
+    assert outline is not None
+    area = 0.5 * abs(np.dot(outline[:, 0], np.roll(outline[:, 1], -1)) - np.dot(outline[:, 1], np.roll(outline[:, 0], -1)))
+    assert 0.5 * size * size <= area < 0.9 * size * size
+    # a full rectangle doesn't save anything
+    assert decaltrim.get_outline(np.ones((8, 8), dtype= bool), (0, 0, 8, 8)) is None
+
+
+def fake_image(pixels):
+    height, width = pixels.shape[:2]
+    image = mock.MagicMock()
+    image.size = (width, height)
+    image.pixels.foreach_get.side_effect = lambda out: out.__setitem__(slice(None), pixels.ravel())
+    return image
+
+
+def test_trim_decal_frees_the_pixels():
+    pixels = np.zeros((16, 16, 4), dtype= np.float32)
+    pixels[4:8, 4:12, 3] = 1.0
+    image = fake_image(pixels)
+
+    trimmed, size, outline = decaltrim.trim_decal(image, "decal.png", 'UV', False, 0.0)
+    assert trimmed is image
+    assert size == (16, 16)
+    assert outline.tolist() == [[0.125, 0.125], [0.875, 0.125], [0.875, 0.625], [0.125, 0.625]]
+    image.buffers_free.assert_called_once()
+
+    image = fake_image(np.zeros((4, 4, 4), dtype= np.float32))
+    assert decaltrim.trim_decal(image, "decal.png", 'UV', False, 0.0)[2] is None
+    image.buffers_free.assert_called_once()
@@ -0,0 +1,63 @@
+import os
+
+from kob import incremental
+
+
+def test_manifest_round_trip(tmp_path):
+    folder = str(tmp_path)
+    entries = {"a.blend": {"hash": "1", "fingerprint": "f"}}
+    incremental.save_manifest(folder, entries)
+    assert incremental.load_manifest(folder) == entries
+
+
+def test_broken_or_old_manifest_is_empty(tmp_path):
+    folder = str(tmp_path)
+    path = incremental.get_manifest_path(folder)
+    with open(path, 'w') as manifest_file:
+        manifest_file.write("{")
+    assert incremental.load_manifest(folder) == {}
+    with open(path, 'w') as manifest_file:
+        manifest_file.write('{"version": 0, "inserts": {"a.blend": {}}}')
+    assert incremental.load_manifest(folder) == {}
+
+
+def test_worker_sees_its_shard_and_merge_removes_it(tmp_path):
+    folder = str(tmp_path)
+    incremental.save_manifest(folder, {"a.blend": {"hash": "1"}})
+    incremental.save_manifest(folder, {"b.blend": {"hash": "2"}}, suffix= ".shard00")
+    assert set(incremental.load_manifest(folder, ".shard00")) == {"a.blend", "b.blend"}
+
+    incremental.merge_manifests(folder, [".shard00", ".shard01"])
+    assert not os.path.exists(incremental.get_manifest_path(folder, ".shard00"))
+    assert set(incremental.load_manifest(folder)) == {"a.blend", "b.blend"}
+
+
+def test_blend_signature_reuses_the_hash(tmp_path):
+    path = tmp_path / "a.blend"
+    path.write_bytes(b"blend")
+    signature = incremental.blend_signature(str(path))
+    assert signature["hash"] == incremental.file_hash(str(path))
+
+    previous = dict(signature, hash= "cached")
+    assert incremental.blend_signature(str(path), previous)["hash"] == "cached"
+
+
+def test_get_stale_blends(tmp_path):
+    blends = []
+    for name in ("up.blend", "changed.blend", "no_thumb.blend", "new.blend"):
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        blends.append(str(path))
+    for name in ("up.png", "changed.png", "new.png"):
+        (tmp_path / name).write_bytes(b"png")
+
+    entries = {}
+    for blend in blends[:3]:
+        signature = incremental.blend_signature(blend)
+        entries[os.path.basename(blend)] = dict(signature, fingerprint= "f")
+    # the blend was written again since its thumbnail was rendered
+    entries["changed.blend"].update(size= 0, hash= "old")
+
+    stale = incremental.get_stale_blends(blends, entries, "f")
+    assert [os.path.basename(blend) for blend in stale] == ["changed.blend", "no_thumb.blend", "new.blend"]
+    assert len(incremental.get_stale_blends(blends, entries, "other")) == 4
@@ -0,0 +1,70 @@
+import os
+
+from kob import journal
+
+
+def write_journal(path, records, tail= ""):
+    with journal.Journal(str(path)) as batch_journal:
+        for blend, state, error in records:
+            batch_journal.record(blend, state, error= error)
+    if tail:
+        with open(path, 'a') as journal_file:
+            journal_file.write(tail)
+
+
+def test_replay_keeps_the_last_state(tmp_path):
+    path = tmp_path / "kpack.journal"
+    write_journal(path, [
+        ("a.blend", journal.RUNNING, None),
+        ("a.blend", journal.DONE, None),
+        ("b.blend", journal.RUNNING, None),
+        ("b.blend", journal.FAILED, "broken"),
+    ])
+    entries = journal.replay([str(path)])
+    assert entries["a.blend"] == {"state": journal.DONE, "error": None, "crashes": 0}
+    assert entries["b.blend"] == {"state": journal.FAILED, "error": "broken", "crashes": 0}
+
+
+def test_replay_counts_crashes_and_skips_incomplete_lines(tmp_path):
+    path = tmp_path / "kpack.journal"
+    write_journal(path, [
+        ("a.blend", journal.RUNNING, None),
+        ("a.blend", journal.RUNNING, None),
+    ], tail= '{"blend": "b.blend", "sta')
+    entries = journal.replay([str(path)])
+    assert entries["a.blend"]["crashes"] == 2
+    assert "b.blend" not in entries
+
+
+def test_replay_reads_the_journals_in_order(tmp_path):
+    main_path = tmp_path / "kpack.journal"
+    run_path = tmp_path / "kpack.shard00.journal"
+    write_journal(main_path, [("a.blend", journal.RUNNING, None)])
+    write_journal(run_path, [("a.blend", journal.DONE, None)])
+    entries = journal.replay([str(main_path), str(run_path), str(tmp_path / "missing.journal")])
+    assert entries["a.blend"]["state"] == journal.DONE
+
+
+def test_get_pending_quarantines_crashing_blends():
+    entries = {
+        "done.blend": {"state": journal.DONE, "error": None, "crashes": 0},
+        "failed.blend": {"state": journal.FAILED, "error": "broken", "crashes": 0},
+        "crash.blend": {"state": journal.RUNNING, "error": None, "crashes": 2},
+    }
+    blends = ["new.blend", "done.blend", "failed.blend", "crash.blend"]
+    pending, quarantined = journal.get_pending(blends, entries, max_crashes= 2)
+    assert pending == ["new.blend", "failed.blend"]
+    assert quarantined == ["crash.blend"]
+
+
+def test_merge_journals_drops_incomplete_lines(tmp_path):
+    folder = str(tmp_path / "kpack")
+    os.mkdir(folder)
+    journal.create_journal(folder)
+    shard_path = journal.get_journal_path(folder, ".shard00")
+    write_journal(shard_path, [("a.blend", journal.DONE, None)], tail= '{"blend"')
+    journal.merge_journals(folder, [".shard00", ".shard01"])
+
+    assert not os.path.exists(shard_path)
+    entries = journal.replay([journal.get_journal_path(folder)])
+    assert list(entries) == ["a.blend"]
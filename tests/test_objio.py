@@ -0,0 +1,101 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from kob import objio
+
+CUBE_FACE = b"""mtllib cube.mtl
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vt 1 1
+vn 0 0 1
+o first
+usemtl red
+f 1/1/1 2/2/1 3/1/1
+o second
+s 1
+f -4//1 -2//1 -1//1
+l 1 2 3
+"""
+
+
+def test_parse_floats():
+    values = objio.parse_floats([b"1 2 3\n", b"4 5 6\n"], 3)
+    assert values.dtype == np.float32
+    assert values.tolist() == [[1, 2, 3], [4, 5, 6]]
+    # w components are dropped
+    assert objio.parse_floats([b"1 2 3 1\n", b"4 5 6 1\n"], 3).tolist() == [[1, 2, 3], [4, 5, 6]]
+    assert objio.parse_floats([], 2).shape == (0, 2)
+
+
+def test_parse_floats_mixed_counts():
+    # as many values as 3 full rows, but not one row per line
+    values = objio.parse_floats([b"1 2 3\n", b"4 5 6 7 8 9\n", b"1 2 3 4 5 6\n"], 3)
+    assert values.tolist() == [[1, 2, 3], [4, 5, 6], [1, 2, 3]]
+    values = objio.parse_floats([b"1 2\n", b"3 4 5\n"], 3)
+    assert values.tolist() == [[1, 2, 0], [3, 4, 5]]
+
+
+def test_parse_corners_layouts():
+    assert objio.parse_corners([b"1", b"2"]).tolist() == [[1, 0, 0], [2, 0, 0]]
+    assert objio.parse_corners([b"1/2", b"3/4"]).tolist() == [[1, 2, 0], [3, 4, 0]]
+    assert objio.parse_corners([b"1//2", b"3//4"]).tolist() == [[1, 0, 2], [3, 0, 4]]
+    assert objio.parse_corners([b"1/2/3", b"-1/-2/-3"]).tolist() == [[1, 2, 3], [-1, -2, -3]]
+    assert objio.parse_corners([b"1/2/3", b"4//5", b"6"]).tolist() == [[1, 2, 3], [4, 0, 5], [6, 0, 0]]
+    assert objio.parse_corners([]).shape == (0, 3)
+
+
+def test_read_obj(tmp_path):
+    path = tmp_path / "cube.obj"
+    path.write_bytes(CUBE_FACE)
+    data = objio.read_obj(str(path), chunk_size= 64)
+
+    assert data.positions.shape == (4, 3)
+    assert data.face_sizes.tolist() == [3, 3]
+    assert data.corner_v.tolist() == [0, 1, 2, 0, 2, 3]
+    assert data.corner_vt.tolist() == [0, 1, 0, -1, -1, -1]
+    assert data.corner_vn.tolist() == [0] * 6
+    assert data.edges.tolist() == [[0, 1], [1, 2]]
+    assert data.mtllibs == ["cube.mtl"]
+    assert [data.states[i] for i in data.face_state] == [("first", "", "red", 0), ("second", "", "red", 1)]
+
+
+def test_get_parts_drops_empty_parts(tmp_path):
+    path = tmp_path / "cube.obj"
+    path.write_bytes(CUBE_FACE)
+    data = objio.read_obj(str(path))
+    props = SimpleNamespace(split_mode= 'ON', use_split_objects= True, use_split_groups= False, use_edges= False)
+
+    parts = objio.get_parts(data, props)
+    assert [name for name, face_mask, edge_mask in parts] == ["first", "second"]
+    assert [face_mask.tolist() for name, face_mask, edge_mask in parts] == [[True, False], [False, True]]
+
+    props.split_mode = 'OFF'
+    assert objio.get_parts(data, props) == [(None, None, None)]
+
+
+def test_write_obj_file_reads_back(tmp_path):
+    mesh = objio.ObjMesh("quad")
+    mesh.positions = np.array(((0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (2, 0, 0)), dtype= np.float32)
+    mesh.face_sizes = np.array((4, 3), dtype= np.int32)
+    mesh.corner_v = np.array((0, 1, 2, 3, 1, 4, 2), dtype= np.int32)
+    mesh.uvs = np.array(((0, 0), (1, 0), (1, 1), (0, 1), (0, 0), (1, 0), (1, 1)), dtype= np.float32)
+    mesh.normals = np.tile(np.array((0, 0, 1), dtype= np.float32), (7, 1))
+    mesh.face_smooth = np.array((False, True))
+    mesh.face_material = np.array((0, 1), dtype= np.int32)
+    mesh.material_names = ["red", "blue"]
+
+    path = tmp_path / "quad.obj"
+    objio.write_obj_file(str(path), [mesh, mesh], "quad.mtl")
+    data = objio.read_obj(str(path))
+
+    assert data.mtllibs == ["quad.mtl"]
+    assert data.positions.shape == (10, 3)
+    assert data.face_sizes.tolist() == [4, 3, 4, 3]
+    assert data.corner_v.tolist() == [0, 1, 2, 3, 1, 4, 2, 5, 6, 7, 8, 6, 9, 7]
+    assert np.allclose(data.uvs[data.corner_vt[:7]], mesh.uvs)
+    assert np.allclose(data.normals[data.corner_vn], (0, 0, 1))
+    assert [data.states[i][2:] for i in data.face_state] == [("red", 0), ("blue", 1)] * 2
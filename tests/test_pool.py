@@ -0,0 +1,19 @@
+from kob import pool
+
+
+def test_split_shards_interleaves_and_drops_empty_shards():
+    assert pool.split_shards([1, 2, 3, 4, 5], 2) == [[1, 3, 5], [2, 4]]
+    assert pool.split_shards([1, 2], 4) == [[1], [2]]
+    assert pool.split_shards([], 3) == []
+
+
+def test_strip_option():
+    argv = ["--workers", "4", "--folder", "x", "--workers=2", "--workers-extra", "1"]
+    assert pool.strip_option(argv, "--workers") == ["--folder", "x", "--workers-extra", "1"]
+    assert pool.strip_option(["--folder", "x"], "--workers") == ["--folder", "x"]
+
+
+def test_worker_command():
+    cmd = pool.worker_command("blender", "", "cli.py", ["thumbs"], "items.txt", ".shard00", 2)
+    assert cmd == ["blender", "-b", "-P", "cli.py", "--", "thumbs",
+        "--items-file", "items.txt", "--log-suffix", ".shard00", "--render-threads", "2"]
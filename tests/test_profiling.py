@@ -0,0 +1,39 @@
+import json
+import os
+import time
+
+from kob import profiling
+
+
+def write_report(path, samples, items, peak_memory):
+    with open(path, 'w') as report_file:
+        json.dump({"samples": samples, "items": items, "peak_memory": peak_memory}, report_file)
+
+
+def test_merge_reports_merges_the_samples(tmp_path):
+    paths = [str(tmp_path / "a.json"), str(tmp_path / "b.json"), str(tmp_path / "missing.json")]
+    write_report(paths[0], {"render": [1.0, 3.0], "setup": [0.5]}, [{"name": "a"}], 100)
+    write_report(paths[1], {"render": [2.0]}, [{"name": "b"}], None)
+
+    report_path = str(tmp_path / "report.json")
+    report = profiling.merge_reports(paths, report_path, 10.0)
+    assert report["samples"] == {"render": [1.0, 3.0, 2.0], "setup": [0.5]}
+    assert report["stages"]["render"]["count"] == 3
+    assert report["stages"]["render"]["total"] == 6.0
+    assert report["stages"]["setup"]["count"] == 1
+    assert report["peak_memory"] == 100
+    assert [item["name"] for item in report["items"]] == ["a", "b"]
+    assert not os.path.exists(paths[0])
+    with open(report_path) as report_file:
+        assert json.load(report_file) == report
+
+
+def test_nested_stages_count_self_time():
+    profiling.begin(True)
+    with profiling.stage("outer"):
+        with profiling.stage("inner"):
+            time.sleep(0.05)
+    report = profiling.get_report()
+    profiling.begin(False)
+    assert report["stages"]["inner"]["total"] >= 0.05
+    assert report["stages"]["outer"]["total"] < 0.05
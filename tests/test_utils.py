@@ -0,0 +1,65 @@
+import json
+import os
+import struct
+import zlib
+
+from kob import utils
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def make_png(width, height, color_type, chunks= ()):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    data = utils.PNG_SIGNATURE + png_chunk(b"IHDR", ihdr)
+    for kind, chunk in chunks:
+        data += png_chunk(kind, chunk)
+    return data + png_chunk(b"IDAT", b"") + png_chunk(b"IEND", b"")
+
+
+def test_read_png_info(tmp_path):
+    path = tmp_path / "decal.png"
+    path.write_bytes(make_png(64, 32, 6))
+    assert utils.read_png_info(str(path)) == {
+        "width": 64, "height": 32, "bit_depth": 8, "color_type": 6, "alpha": True}
+
+    path.write_bytes(make_png(8, 8, 2))
+    assert utils.read_png_info(str(path))["alpha"] is False
+    path.write_bytes(make_png(8, 8, 2, [(b"tRNS", b"\0\0\0\0\0\0")]))
+    assert utils.read_png_info(str(path))["alpha"] is True
+
+
+def test_read_png_info_invalid(tmp_path):
+    path = tmp_path / "decal.png"
+    data = make_png(64, 32, 6)
+    # truncated in the signature, the chunk header and the IHDR chunk
+    for size in (4, 12, 20):
+        path.write_bytes(data[:size])
+        assert utils.read_png_info(str(path)) is None
+    path.write_bytes(make_png(0, 32, 6))
+    assert utils.read_png_info(str(path)) is None
+    path.write_bytes(b"GIF89a" + data[6:])
+    assert utils.read_png_info(str(path)) is None
+
+
+def write_shard_report(folder, suffix, duplicates, geometry):
+    with open(utils.get_duplicates_path(folder, suffix), 'w') as report_file:
+        json.dump({"duplicates": duplicates, "geometry": geometry}, report_file)
+
+
+def test_merge_duplicate_reports_across_shards(tmp_path):
+    folder = str(tmp_path / "kpack")
+    os.mkdir(folder)
+    for name in ("a.blend", "b.blend", "c.blend"):
+        open(os.path.join(folder, name), 'w').close()
+    write_shard_report(folder, ".shard00", {}, {"a.blend": "key1"})
+    # c.blend was a duplicate of b.blend, which duplicates a.blend of the first shard
+    write_shard_report(folder, ".shard01", {"c.blend": "b.blend"}, {"b.blend": "key1"})
+
+    utils.merge_duplicate_reports(folder, [".shard00", ".shard01"])
+    assert os.path.exists(os.path.join(folder, "a.blend"))
+    assert not os.path.exists(os.path.join(folder, "b.blend"))
+    assert not os.path.exists(utils.get_duplicates_path(folder, ".shard00"))
+    with open(utils.get_duplicates_path(folder, "")) as report_file:
+        assert json.load(report_file) == {"b.blend": "a.blend", "c.blend": "a.blend"}
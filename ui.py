@@ -53,7 +53,8 @@ class KitOpsBatchPanel(bpy.types.Panel):
 
             col.prop(props, "auto_camera_pos")
 
-            sub = col.row()
+            sub = col.column()
+            sub.prop(props, "camera_framing", text= "")
             sub.prop(props, "camera_padding")
             if not props.auto_camera_pos:
                 sub.enabled = False
@@ -75,6 +76,28 @@ class KitOpsBatchPanel(bpy.types.Panel):
             utils.wrap_text(sub, "Step 5: Batch render the entire KPACK folder of INSERTS", line_width)
             sub.scale_y = labels_hight
 
+            col.prop(props, "fast_append")
+            col.prop(props, "persistent_session")
+            col.prop(props, "render_budget")
+
+            sub = col.column(align= True)
+            sub.prop(props, "budget_max_samples")
+            sub.prop(props, "budget_noise_threshold")
+            sub.prop(props, "budget_time_limit")
+            sub.prop(props, "budget_texture_limit", text= "")
+            sub.prop(props, "budget_draft_engine", text= "")
+            sub.prop(props, "budget_denoise")
+            if not props.render_budget:
+                sub.enabled = False
+
+            col.prop(props, "incremental_render")
+            col.prop(props, "resume_render")
+
+            sub = col.row()
+            sub.prop(props, "max_crashes")
+            if not props.resume_render:
+                sub.enabled = False
+
             sub = col.column()
             sub.operator("kob.batch_render_thumbs")
             sub.scale_y = buttons_hight
@@ -100,6 +123,23 @@ class KitOpsBatchPanel(bpy.types.Panel):
             sub.scale_y = labels_hight
 
             col.prop(props, "decal_temp_file", text= "")
+            col.prop(props, "decal_material")
+            row = col.row()
+            row.prop(props, "decal_trim")
+            sub = row.row()
+            sub.enabled = props.decal_trim != 'NONE'
+            sub.prop(props, "decal_cutout")
+            sub = col.row()
+            sub.enabled = props.decal_trim != 'NONE'
+            sub.prop(props, "decal_alpha_threshold")
+            row = col.row()
+            row.prop(props, "decal_adaptive_subdiv")
+            row.prop(props, "decal_bake_modifiers")
+            row = col.row()
+            row.prop(props, "decal_max_subdiv")
+            sub = row.row()
+            sub.enabled = props.decal_adaptive_subdiv
+            sub.prop(props, "decal_subdiv_edge")
             col.label(text= "")
 
             sub = col.column()
@@ -167,6 +207,11 @@ class ConvertOBJtoBlendPanel(bpy.types.Panel):
         col.prop(props, "create_insert")
         col.prop(props, "center_n_set")
         col.prop(props, "clear_split_normals")
+        row = col.row(align= True)
+        row.enabled = props.clear_split_normals
+        row.prop(props, "sharp_by_angle")
+        row.prop(props, "sharp_angle")
+        col.prop(props, "deduplicate")
         col.label(text= "Material Override:")
         col.prop(props, "override_material", text= "")
         col = layout.column()
@@ -209,6 +254,10 @@ class ConvertBlendToOBJPanel(bpy.types.Panel):
         row = col.row(align=True)
         row.prop_enum(props, "convert_mode", "0")
         row.prop_enum(props, "convert_mode", "1")
+        col.prop(props, "obj_writer")
+        sub = col.column()
+        sub.enabled = props.obj_writer == 'BUILTIN'
+        sub.prop(props, "obj_write_threads")
 
         col = layout.column()
         sub = col.column()
@@ -249,6 +298,9 @@ class ExportToBlendPanel(bpy.types.Panel):
         sub.scale_y = labels_hight
         col = layout.column()
 
+        col = layout.column()
+        col.prop(props, "deduplicate")
+
         col = layout.column()
         col.operator("kob.batch_export_blend")
         col.scale_y = buttons_hight
@@ -271,6 +323,11 @@ class OBJExportSettingsPanel(bpy.types.Panel):
         props = utils.get_props()
         col = layout.column()
 
+        col.prop(props, "obj_reader")
+        sub = col.column()
+        sub.enabled = props.obj_reader == 'BUILTIN'
+        sub.prop(props, "obj_lookahead")
+        sub.prop(props, "geometry_cache")
         col.prop(props, "use_image_search")
         col.prop(props, "use_smooth_groups")
         col.prop(props, "use_edges")
@@ -1,16 +1,27 @@
 import bpy
+import hashlib
+import json
+import math
 import os
+import re
+import struct
 import webbrowser
 import textwrap
 from mathutils import Matrix, Vector
 import sys
 import bmesh
 import numpy as np
+from . import objio
+from . import profiling
 
 def get_props():
     """Get addon properties"""
     return bpy.context.window_manager.kob
 
+def get_prefs():
+    """Get addon preferences"""
+    return bpy.context.preferences.addons[__package__].preferences
+
 def shade_flat(ob):
     """Flat shading the faces of an object"""
     if ob.type == 'MESH':
@@ -19,55 +30,141 @@ def shade_flat(ob):
     for f in mesh.polygons:
         f.use_smooth = False
     
-def append_all_objects(operator, blend_file_path):
-    """Append all objects from blend file"""
-
-    # assign "tmp" id to all existing objects before appending
-    # for ob in bpy.data.objects:
-    #     ob.kitops.id = "tmp"
-
-    # with bpy.data.libraries.load(blend_file_path, link=False) as (data_from, data_to):
-    #     data_to.objects = data_from.objects
-
-    # for ob in data_to.objects:
-    #     if ob is not None:
-    #         bpy.context.collection.objects.link(ob)
-    #         ob.kob_insert_object = True
-    # return data_to.objects
-    
-    # assign a keep property to use it later for deleting imported objects
+def flag_existing_data():
+    """Flag all existing objects and collections to keep them when cleanup is performed"""
     for ob in bpy.data.objects:
         ob.keep_object = True
     
     for col in bpy.data.collections:
         col.keep_collection = True
 
+@profiling.timed("append")
+def append_all_objects(operator, blend_file_path):
+    """Append all objects from blend file
+
+    Returns the datablocks created by the append, existing data has to be
+    flagged with flag_existing_data() before.
+    """
+    props = get_props()
+
+    if props.fast_append:
+        target_obj = bpy.data.objects.get("Floor")
+        if target_obj is None:
+            operator.report({'WARNING'}, "Please make sure the render file has a Floor object")
+            return []
+        if not props.persistent_session:
+            # in a render session the floor is prepared once
+            shade_flat(target_obj)
+        imported = append_insert(blend_file_path, target_obj, bpy.context.scene.collection)
+        print("insert imported")
+        return imported
+
     # import using the insert operator from KIT OPS
     kitops_pref = bpy.context.preferences.addons['kitops'].preferences
     kitops_pref.mode = 'SMART'
 
     # deselect everything, it's necessary to prevent the
     # need for mouse input upon insert import
-    for ob in bpy.data.objects:
+    for ob in bpy.context.view_layer.objects.selected:
         ob.select_set(False)
 
-    if "Floor" in [ob.name for ob in bpy.data.objects]:
-        # assign the ground plane as a target object to insert main object
-        target_obj = bpy.data.objects['Floor']
+    # the names before the import tell what the insert added
+    object_names = set(bpy.data.objects.keys())
+    collection_names = set(bpy.data.collections.keys())
 
+    target_obj = bpy.data.objects.get("Floor")
+    if target_obj is not None:
         # flat shading the floor object
-        shade_flat(target_obj)
+        if not props.persistent_session:
+            shade_flat(target_obj)
 
         # importing the insert
         bpy.ops.ko.add_insert('INVOKE_DEFAULT', location= blend_file_path)
-
-        for ob in bpy.data.objects:
-            if ob.kitops.insert:
-                ob.kitops.insert_target = target_obj
     else:
         operator.report({'WARNING'}, "Please make sure the render file has a Floor object")
 
+    imported = get_new_datablocks(object_names, collection_names)
+    for ob in imported:
+        if isinstance(ob, bpy.types.Object) and ob.kitops.insert:
+            # assign the ground plane as a target object to insert main object
+            ob.kitops.insert_target = target_obj
+
     print("insert imported")
+    return imported
+
+def get_new_datablocks(object_names, collection_names):
+    """Get the objects and collections not in the given name sets and the data they use"""
+    objects = [bpy.data.objects[name] for name in set(bpy.data.objects.keys()) - object_names]
+    collections = [bpy.data.collections[name] for name in set(bpy.data.collections.keys()) - collection_names]
+    return collections + get_datablocks(objects)
+
+def append_insert(blend_file_path, target_obj, parent_collection):
+    """Append the INSERT objects of a blend file at the data level
+
+    Works without a window and without touching the selection, returns
+    the list of all the datablocks created by the append.
+    """
+    with bpy.data.libraries.load(blend_file_path, link= False) as (data_from, data_to):
+        data_to.objects = data_from.objects
+
+    objects = [ob for ob in data_to.objects if ob is not None]
+
+    insert_name = os.path.splitext(os.path.basename(blend_file_path))[0]
+    insert_collection = bpy.data.collections.new(insert_name)
+    parent_collection.children.link(insert_collection)
+
+    for ob in objects:
+        insert_collection.objects.link(ob)
+        ob.kitops.insert = True
+        ob.kitops.insert_target = target_obj
+        if ob.display_type in {'WIRE', 'BOUNDS'}:
+            # cutters and helpers are displayed as wire, keep them out of the render
+            ob.hide_render = True
+
+    return [insert_collection] + get_datablocks(objects)
+
+def get_datablocks(objects):
+    """Get the objects and the local datablocks they use: object data,
+    materials, modifier textures, images and node groups"""
+    ids = []
+    seen = set()
+
+    def add(block):
+        if block is not None and block.library is None and block not in seen:
+            seen.add(block)
+            ids.append(block)
+
+    materials = []
+    for ob in objects:
+        add(ob)
+        add(ob.data)
+        for slot in ob.material_slots:
+            if slot.material is not None:
+                materials.append(slot.material)
+        if hasattr(ob.data, "materials"):
+            materials += [mat for mat in ob.data.materials if mat is not None]
+        for mod in ob.modifiers:
+            texture = getattr(mod, "texture", None)
+            if texture is not None:
+                add(texture)
+                add(getattr(texture, "image", None))
+
+    node_trees = []
+    for mat in materials:
+        add(mat)
+        if mat.node_tree is not None:
+            node_trees.append(mat.node_tree)
+
+    # walk the node trees and the node groups used inside them
+    while node_trees:
+        tree = node_trees.pop()
+        for node in tree.nodes:
+            if node.type == 'GROUP' and node.node_tree is not None and node.node_tree not in seen:
+                add(node.node_tree)
+                node_trees.append(node.node_tree)
+            add(getattr(node, "image", None))
+
+    return ids
 
 def get_kpack_name(path):
     """Get kpack folder name from folder path"""
@@ -100,6 +197,7 @@ def get_blends(path):
     blend_files_paths = [os.path.join(path, b) for b in blend_files]
     return blend_files_paths
 
+@profiling.timed("cleanup")
 def clean_all_imported():
     """Remove all imported objects and collections"""
     # for ob in bpy.data.objects:
@@ -113,66 +211,199 @@ def clean_all_imported():
         if not col.keep_collection:
             bpy.data.collections.remove(col)
 
+@profiling.timed("cleanup")
+def remove_datablocks(blocks):
+    """Remove imported datablocks in bulk
+
+    Objects and collections are always removed, the other datablocks only
+    once nothing else uses them anymore. Returns the datablocks still used.
+    """
+    owners = [block for block in blocks if isinstance(block, (bpy.types.Object, bpy.types.Collection))]
+    owner_ids = {id(block) for block in owners}
+    remaining = [block for block in blocks if id(block) not in owner_ids]
+    bpy.data.batch_remove(owners)
+
+    # removing meshes frees materials, removing materials frees images and node groups
+    while remaining:
+        orphans = [block for block in remaining if block.users == 0]
+        if not orphans:
+            break
+        orphan_ids = {id(block) for block in orphans}
+        remaining = [block for block in remaining if id(block) not in orphan_ids]
+        bpy.data.batch_remove(orphans)
+    return remaining
+
 def prepare_render():
     """Prepare render settings"""
     bpy.context.scene.render.image_settings.file_format='PNG'
 
-def align_camera_to_insert():
-    """Select insert objects and align active camera to it"""
-    select_insert_objects()
-    if bpy.context.scene.camera:
+def begin_render_session(scene):
+    """Keep the static render scene data loaded between the thumbnail renders
+
+    Prepares the Floor once and enables Cycles persistent data so the BVH,
+    textures and shaders of the scene are reused, only the INSERT changes
+    between renders. Returns the settings to restore in end_render_session.
+    """
+    state = {"use_persistent_data": scene.render.use_persistent_data}
+    scene.render.use_persistent_data = True
+
+    floor = bpy.data.objects.get("Floor")
+    if floor is not None:
+        shade_flat(floor)
+    return state
+
+def end_render_session(scene, state):
+    """Restore the render settings changed by begin_render_session"""
+    scene.render.use_persistent_data = state["use_persistent_data"]
+
+# object types with geometry that can be framed by the camera
+FRAMED_TYPES = {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}
+
+def get_insert_objects():
+    """Get the insert objects of the scene"""
+    return [ob for ob in bpy.context.scene.objects if ob.kitops.insert]
+
+def get_world_points(objects, depsgraph, tight= False):
+    """Get the world space points the camera has to frame, bound box corners
+    or evaluated mesh vertices when tight is enabled"""
+    chunks = []
+    for ob in objects:
+        if ob.hide_render or ob.type not in FRAMED_TYPES:
+            continue
+        ob_eval = ob.evaluated_get(depsgraph)
+        matrix = np.array(ob_eval.matrix_world)
+
+        if tight and ob.type == 'MESH':
+            mesh = ob_eval.to_mesh()
+            co = np.empty(len(mesh.vertices) * 3, dtype= np.float64)
+            mesh.vertices.foreach_get("co", co)
+            ob_eval.to_mesh_clear()
+            co = co.reshape(-1, 3)
+        else:
+            co = np.array([v[:] for v in ob_eval.bound_box])
+
+        chunks.append(co @ matrix[:3, :3].T + matrix[:3, 3])
+
+    if not chunks:
+        return np.empty((0, 3))
+    return np.concatenate(chunks)
+
+def frame_camera(camera, scene, points):
+    """Move the camera along its fixed orientation so all points fit its frame"""
+    rotation = camera.matrix_world.to_3x3().normalized()
+    rot = np.array(rotation)
+    # points in the camera orientation space, the camera looks down -Z
+    x, y, z = (points @ rot).T
+
+    # half size of the frame at distance 1, for the render aspect and sensor fit
+    frame = camera.data.view_frame(scene= scene)
+    half_x = max(abs(v.x) for v in frame)
+    half_y = max(abs(v.y) for v in frame)
+    depth = abs(frame[0].z)
+
+    if camera.data.type == 'ORTHO':
+        scale = max((x.max() - x.min()) / (2 * half_x), (y.max() - y.min()) / (2 * half_y))
+        camera.data.ortho_scale *= max(scale, 1e-6)
+        center_x = (x.max() + x.min()) / 2
+        center_y = (y.max() + y.min()) / 2
+        distance = z.max() + camera.data.clip_start + 0.01 * (z.max() - z.min())
+    else:
+        tan_x = half_x / depth
+        tan_y = half_y / depth
+        # for every point |x - cx| <= tan_x * (distance - z), the smallest
+        # distance where an interval for cx exists fits all points
+        far_x, near_x = (x + tan_x * z).max(), (x - tan_x * z).min()
+        far_y, near_y = (y + tan_y * z).max(), (y - tan_y * z).min()
+        distance = max((far_x - near_x) / (2 * tan_x), (far_y - near_y) / (2 * tan_y))
+        distance = max(distance, z.max() + camera.data.clip_start)
+        center_x = (far_x + near_x) / 2
+        center_y = (far_y + near_y) / 2
+
+    matrix = camera.matrix_world.copy()
+    matrix.translation = rotation @ Vector((center_x, center_y, distance))
+    camera.matrix_world = matrix
+
+@profiling.timed("framing")
+def align_camera_to_insert(objects= None):
+    """Align active camera to the insert objects"""
+    props = get_props()
+    camera = bpy.context.scene.camera
+    if camera is None:
+        return
+
+    if props.camera_framing == 'VIEW' and bpy.context.window is not None:
+        # select insert objects and use the 3D View operator
+        select_insert_objects()
         bpy.ops.view3d.camera_to_view_selected()
+    else:
+        if objects is None:
+            objects = get_insert_objects()
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        points = get_world_points(objects, depsgraph, tight= props.camera_framing == 'TIGHT')
+        if len(points):
+            frame_camera(camera, bpy.context.scene, points)
     
     # moving camera in local z direction according
     # to camera padding value if "auto_camera_pos" enabled
-    props = get_props()
     camera_padding = props.camera_padding
     if props.auto_camera_pos:
         loc = Matrix.Translation((0.0, 0.0, camera_padding))
-        bpy.context.scene.camera.matrix_basis @= loc
+        camera.matrix_basis @= loc
 
-def render_inserts(is_exported, blend_path=None):
+def render_inserts(is_exported, blend_path=None, objects=None):
     """"Render and export images"""
     props = get_props()
     
     if props.auto_camera_pos:
-        align_camera_to_insert()
+        align_camera_to_insert(objects)
 
     if blend_path:
         bpy.context.scene.render.filepath = os.path.splitext(blend_path)[0]+".png"
 
     if is_exported:
-        bpy.ops.render.render(write_still= is_exported)
+        with profiling.stage("render"):
+            bpy.ops.render.render(write_still= is_exported)
     else:
         # making sure rendering window opens up when runing a test render
         bpy.ops.render.render('INVOKE_DEFAULT', write_still= is_exported)
 
+def get_log_file_path(kpack_folder_path, suffix= None):
+    """Get the text log file path, workers use a suffix to get their own log"""
+    if suffix is None:
+        suffix = get_props().log_suffix
+    kpack_name = get_kpack_name(kpack_folder_path)
+    abs_path = bpy.path.abspath(kpack_folder_path)
+    # norm_path = os.path.normpath(abs_path)
+    return os.path.join(abs_path, kpack_name + suffix + ".txt")
+
+def get_profile_path(folder_path, suffix= None):
+    """Get the path of the profiling report written next to the log file"""
+    return os.path.splitext(get_log_file_path(folder_path, suffix))[0] + ".profile.json"
+
 def open_log_file(kpack_folder_path):
     """Open the log file in the defult text editor"""
-    kpack_name = get_kpack_name(kpack_folder_path)
-    log_file_path = os.path.join(kpack_folder_path, kpack_name + ".txt")
+    log_file_path = get_log_file_path(kpack_folder_path, "")
 
     webbrowser.open(log_file_path)
 
 def write_log_entry(kpack_folder_path, blend_file_path):
     """Add a log entry to the text log file"""
-    kpack_name = get_kpack_name(kpack_folder_path)
-
-    abs_path = bpy.path.abspath(kpack_folder_path)
-    log_file_path = os.path.join(abs_path, kpack_name + ".txt")
+    log_file_path = get_log_file_path(kpack_folder_path)
 
     with open(log_file_path, 'a') as log:
         log.write(f"{blend_file_path}\n")
 
 def create_log_file(kpack_folder_path):
     """Create a new empty log file"""
-    kpack_name = get_kpack_name(kpack_folder_path)
-    abs_path = bpy.path.abspath(kpack_folder_path)
-    # norm_path = os.path.normpath(abs_path)
-    log_file_path = os.path.join(abs_path, kpack_name + ".txt")
+    log_file_path = get_log_file_path(kpack_folder_path)
 
     with open(log_file_path, 'w') as log:
         log.write("")
+
+def read_items_file(path):
+    """Read a list of items to process, one per line"""
+    with open(path) as items_file:
+        return [line.rstrip("\n") for line in items_file if line.strip()]
     
 def wrap_text(col, text, width):
     wrapp = textwrap.TextWrapper(width=width)
@@ -196,29 +427,70 @@ def enable_render_window():
     """Temporarily enable rendering in a new window if it's already disabled by the user"""
     pass
 
-def purge_orphan_data():
-    """Purge all unused data blocks"""
-    for block in bpy.data.meshes:
-        if block.users == 0:
-            bpy.data.meshes.remove(block)
-
-    for block in bpy.data.materials:
-        if block.users == 0:
-            bpy.data.materials.remove(block)
-
-    for block in bpy.data.textures:
-        if block.users == 0:
-            bpy.data.textures.remove(block)
-
-    for block in bpy.data.images:
-        if block.users == 0:
-            bpy.data.images.remove(block)
-
-    for lib in bpy.data.libraries:
-        # clearing library users, preparing to purge it
-        lib.user_clear()
-
-    bpy.ops.outliner.orphans_purge()
+class DeferredPurge:
+    """Collect the datablocks left by the exported objects and remove them in bulk
+
+    The datablocks are removed every interval items or as soon as the memory
+    used by Blender goes over memory_limit bytes.
+    """
+
+    def __init__(self, interval= 25, memory_limit= 0):
+        self.interval = interval
+        self.memory_limit = memory_limit
+        self.blocks = []
+        self.count = 0
+
+    def add(self, blocks):
+        self.blocks += blocks
+
+    def step(self):
+        """Count an exported item and purge if it is time to"""
+        self.count += 1
+        if self.count % self.interval == 0:
+            self.flush()
+        elif self.memory_limit and (profiling.get_memory() or 0) > self.memory_limit:
+            self.flush()
+
+    @profiling.timed("purge")
+    def flush(self):
+        """Remove the collected datablocks nothing uses anymore"""
+        # datablocks still used by objects that aren't exported yet are
+        # kept for the next purge
+        self.blocks = remove_datablocks(self.blocks)
+
+def get_deferred_purge():
+    """Create a deferred purge with the interval and memory limit from the preferences"""
+    prefs = get_prefs()
+    return DeferredPurge(prefs.purge_interval, prefs.purge_memory_limit * 2**20)
+
+# datablock types a batch leaves behind
+BATCH_DATA_TYPES = ("objects", "meshes", "materials", "textures", "images", "node_groups")
+
+def snapshot_datablocks(types= BATCH_DATA_TYPES):
+    """Get the names of the datablocks of the given types"""
+    return {data_type: set(getattr(bpy.data, data_type).keys()) for data_type in types}
+
+# datablock types an INSERT import can create
+INSERT_DATA_TYPES = ("collections",) + BATCH_DATA_TYPES
+
+def get_created_datablocks(snapshot):
+    """Get the datablocks created since the snapshot"""
+    blocks = []
+    for data_type, names in snapshot.items():
+        data = getattr(bpy.data, data_type)
+        blocks += [data[name] for name in set(data.keys()) - names]
+    return blocks
+
+@profiling.timed("purge")
+def purge_new_orphans(snapshot):
+    """Remove the unused datablocks created since the snapshot
+
+    Only the datablocks added by the batch are looked at, not the whole file.
+    """
+    # objects are only orphans when no collection uses them
+    blocks = [block for block in get_created_datablocks(snapshot)
+        if not isinstance(block, bpy.types.Object) or block.users == 0]
+    remove_datablocks(blocks)
 
 def get_objs(dir_path):
     """Get a list of all OBJ files in a directory"""
@@ -226,14 +498,29 @@ def get_objs(dir_path):
     # print (*objs)
     return objs
 
-def import_obj(path):
-    """Import obj file to the scene"""
+@profiling.timed("obj_import")
+def import_obj(path, data= None):
+    """Import obj file to the scene, data is the file already parsed by the built-in reader"""
     props = get_props()
     obj_folder = bpy.path.abspath(props.obj_folder)
     file_path = os.path.join(obj_folder, path)
 
+    if props.obj_reader == 'BUILTIN':
+        return objio.import_obj(file_path, props, bpy.context.collection, data)
+
     version = bpy.app.version
-    if version < (2, 92, 0):
+    if "obj" not in dir(bpy.ops.import_scene):
+        # the python importer was removed, use the C++ one
+        bpy.ops.wm.obj_import(
+            filepath= file_path,
+            use_split_objects= props.split_mode == 'ON' and props.use_split_objects,
+            use_split_groups= props.split_mode == 'ON' and props.use_split_groups,
+            import_vertex_groups= props.split_mode == 'OFF' and props.use_groups_as_vgroups,
+            clamp_size= props.global_clight_size,
+            forward_axis= props.axis_forward.replace("-", "NEGATIVE_"),
+            up_axis= props.axis_up.replace("-", "NEGATIVE_")
+        )
+    elif version < (2, 92, 0):
         bpy.ops.import_scene.obj(
             filepath= file_path,
             use_edges= props.use_edges,
@@ -280,10 +567,21 @@ def copy_scene():
         new_scene.collection.objects.unlink(ob)
 
     # set the new scene as active
-    bpy.context.window.scene = new_scene
+    set_active_scene(new_scene)
 
     return new_scene
 
+def set_active_scene(scene):
+    """Make scene the active scene, also when running without a window"""
+    window = bpy.context.window
+    if window is None and bpy.context.window_manager.windows:
+        # in background mode there is no active window, but the windows
+        # stored in the blend file still decide which scene is used
+        window = bpy.context.window_manager.windows[0]
+
+    if window is not None:
+        window.scene = scene
+
 def get_principled_node(material):
     """Get the principled node that is connected to material output"""
     for node in material.node_tree.nodes:
@@ -423,9 +721,16 @@ def fix_map_nodes(material, suffix_list):
             reconnect_node(material, node, texture_type, principled_node)
 
 
-def create_blend(dir_path, ob, scene, operator, create_insert= True, children= []):
-    """Save objects to a new blend file in dir_path"""
+@profiling.timed("write_blend")
+def create_blend(dir_path, ob, scene, operator, create_insert= True, children= [], purge= None):
+    """Save objects to a new blend file in dir_path
+
+    The meshes, materials and images of the objects are removed after the
+    export, in bulk by purge when given.
+    """
     props = get_props()
+    # the data the objects leave behind, before the material override
+    blocks = [block for block in get_datablocks([ob] + children) if not isinstance(block, bpy.types.Object)]
     use_suffix, suffix_list = get_addon_prefs()
     # create_insert = props.create_insert
 
@@ -465,20 +770,160 @@ def create_blend(dir_path, ob, scene, operator, create_insert= True, children= [
         bpy.data.libraries.write(filepath, data_blocks)
 
     # remove the object after exported
-    for ob_ in [ob] + children:
-        bpy.data.objects.remove(ob_, do_unlink= True)
-
-    # clear all unused meshes and materials
-    for block in bpy.data.meshes:
-        if block.users == 0:
-            bpy.data.meshes.remove(block)
-            
-    for block in bpy.data.materials:
-        if block.users == 0:
-            bpy.data.materials.remove(block)
+    discard_objects([ob] + children, blocks, purge)
 
     return filepath
 
+def discard_objects(objects, blocks= None, purge= None):
+    """Remove objects and the meshes, materials and images they leave behind"""
+    if blocks is None:
+        blocks = [block for block in get_datablocks(objects) if not isinstance(block, bpy.types.Object)]
+    bpy.data.batch_remove(objects)
+
+    if purge:
+        purge.add(blocks)
+        purge.step()
+    else:
+        remove_datablocks(blocks)
+
+def get_geometry_hash(objects, tolerance= 1e-5):
+    """Hash the geometry, UVs and materials of mesh objects, None for other objects
+
+    The vertices are quantized to the tolerance so the same mesh read from
+    differently formatted files gets the same hash.
+    """
+    sha1 = hashlib.sha1()
+    for ob in objects:
+        if ob.type != 'MESH':
+            return None
+        mesh = ob.data
+        co = np.empty(len(mesh.vertices) * 3, dtype= np.float32)
+        mesh.vertices.foreach_get("co", co)
+        corner_v = np.empty(len(mesh.loops), dtype= np.int32)
+        mesh.loops.foreach_get("vertex_index", corner_v)
+        face_sizes = np.empty(len(mesh.polygons), dtype= np.int32)
+        mesh.polygons.foreach_get("loop_total", face_sizes)
+
+        for array in (co, corner_v, face_sizes):
+            sha1.update(np.int64(array.size).tobytes())
+        sha1.update(np.round(co / tolerance).astype(np.int64).tobytes())
+        sha1.update(corner_v.tobytes())
+        sha1.update(face_sizes.tobytes())
+        sha1.update(np.round(np.array(ob.matrix_world) / tolerance).astype(np.int64).tobytes())
+
+        for uv_layer in mesh.uv_layers:
+            uvs = np.empty(len(mesh.loops) * 2, dtype= np.float32)
+            uv_layer.data.foreach_get("uv", uvs)
+            sha1.update(np.round(uvs / tolerance).astype(np.int64).tobytes())
+        for slot in ob.material_slots:
+            # materials read again from the same MTL get a .001 suffix
+            name = re.sub(r"\.\d{3}$", "", slot.material.name) if slot.material else ""
+            sha1.update(name.encode() + b"\0")
+    return sha1.hexdigest()
+
+def get_mesh_key(objects, center_n_set= True):
+    """Get a key of the mesh datablocks of objects and their transforms
+
+    Objects sharing mesh datablocks with the same transforms get the same key
+    before the transforms are applied, None for other objects. The locations
+    are relative to the first object when the origins are reset.
+    """
+    origin = np.array(objects[0].matrix_world.translation) if center_n_set else np.zeros(3)
+    parts = []
+    for ob in objects:
+        if ob.type != 'MESH':
+            return None
+        matrix = np.array(ob.matrix_world)
+        rotation_scale = np.round(matrix[:3, :3], 5)
+        location = np.round(matrix[:3, 3] - origin, 5)
+        parts.append((ob.data.name, tuple(rotation_scale.ravel().tolist()), tuple(location.tolist())))
+    return "mesh:" + repr(parts)
+
+def get_duplicates_path(folder_path, suffix= None):
+    """Get the path of the duplicates report written next to the log file"""
+    return os.path.splitext(get_log_file_path(folder_path, suffix))[0] + ".duplicates.json"
+
+def merge_duplicate_reports(folder_path, suffixes):
+    """Merge the duplicates reports written by the workers into the main report
+
+    The workers only see their own blends, a blend with the same geometry
+    hash as a blend of an earlier worker is removed and reported too.
+    """
+    duplicates = {}
+    originals = {}
+    for suffix in suffixes:
+        shard_path = get_duplicates_path(folder_path, suffix)
+        if not os.path.exists(shard_path):
+            continue
+        with open(shard_path) as report_file:
+            report = json.load(report_file)
+        os.remove(shard_path)
+
+        duplicates.update(report["duplicates"])
+        for blend_name, key in report["geometry"].items():
+            original = originals.setdefault(key, blend_name)
+            if original != blend_name:
+                blend_path = os.path.join(bpy.path.abspath(folder_path), blend_name)
+                if os.path.exists(blend_path):
+                    os.remove(blend_path)
+                duplicates[blend_name] = original
+                print(f"{blend_name} has the same geometry as {original}, removed")
+
+    # the duplicates of a removed blend point to the blend that was kept
+    for blend_name, original in duplicates.items():
+        while original in duplicates:
+            original = duplicates[original]
+        duplicates[blend_name] = original
+
+    if duplicates:
+        with open(get_duplicates_path(folder_path, ""), 'w') as report_file:
+            json.dump(duplicates, report_file, indent= 1, sort_keys= True)
+
+class Deduplicator:
+    """Find the objects with the same geometry as an already written blend"""
+
+    def __init__(self, enabled= True):
+        self.enabled = enabled
+        self.blends = {}
+        self.duplicates = {}
+        # geometry hash of every written blend, compared across workers
+        self.hashes = {}
+
+    @profiling.timed("dedup")
+    def find(self, objects, blend_name, key= None):
+        """Get the blend already written with the same geometry, None if there is none"""
+        if not self.enabled:
+            return None
+        geometry = key is None
+        if geometry:
+            key = get_geometry_hash(objects)
+        if key is None:
+            return None
+        original = self.blends.setdefault(key, blend_name)
+        if original == blend_name:
+            if geometry:
+                self.hashes[blend_name] = key
+            return None
+        self.duplicates[blend_name] = original
+        print(f"{blend_name} has the same geometry as {original}, skipped")
+        return original
+
+    def write_report(self, folder_path):
+        """Write which blends were skipped and the blend they duplicate
+
+        Workers also write the geometry hashes of their blends for the merge.
+        """
+        if get_props().log_suffix:
+            if self.enabled:
+                report = {"duplicates": self.duplicates, "geometry": self.hashes}
+                with open(get_duplicates_path(folder_path), 'w') as report_file:
+                    json.dump(report, report_file, indent= 1, sort_keys= True)
+            return
+        if not self.duplicates:
+            return
+        with open(get_duplicates_path(folder_path), 'w') as report_file:
+            json.dump(self.duplicates, report_file, indent= 1, sort_keys= True)
+
 
 def origin_to_bottom(ob, activate= True):
     """Assign the origin to the bottom center of object bound box"""
@@ -507,12 +952,81 @@ def reset_transforms(ob, activate= True):
     if activate:
         ob.matrix_basis = Matrix()
 
-def clear_custom_split_normals(ob, activate= True):
-    """Clear custom split normals of object"""
-    if activate:
-        bpy.context.view_layer.objects.active = ob
-        bpy.ops.mesh.customdata_custom_splitnormals_clear()
-        print ("Custom split normals cleared")
+def normalise_object_legacy(ob, scale= 1.0, center_n_set= True):
+    """Scale, apply transforms and set the origin with the object operators"""
+    ob.scale *= scale
+    bpy.context.view_layer.update()
+    apply_transforms(ob)
+    bpy.context.view_layer.update()
+    origin_to_bottom(ob, center_n_set)
+    bpy.context.view_layer.update()
+    reset_transforms(ob, center_n_set)
+    bpy.context.view_layer.update()
+
+def can_normalise_vertices(ob):
+    """Check if the object transforms can be applied to its vertices only"""
+    # shape keys, modifiers, parents and constraints change the result
+    # of the bound box or the world matrix, they take the legacy path
+    return (ob.type == 'MESH' and not ob.data.shape_keys and not ob.modifiers
+        and not ob.parent and not ob.children and not ob.constraints)
+
+def normalise_objects(objects, scale= 1.0, center_n_set= True):
+    """Scale, apply transforms and set the origin to the bottom center
+
+    The vertices of each mesh are read and written once and the view layer
+    is updated once for all the objects.
+    """
+    for ob in objects:
+        if not can_normalise_vertices(ob):
+            normalise_object_legacy(ob, scale, center_n_set)
+            continue
+
+        mesh = ob.data
+        matrix = np.array(ob.matrix_world @ Matrix.Diagonal((scale, scale, scale, 1.0)))
+        co = np.empty(len(mesh.vertices) * 3, dtype= np.float32)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+        if center_n_set and len(co):
+            low, high = co.min(axis= 0), co.max(axis= 0)
+            origin = (low + high) / 2
+            origin[2] = low[2]
+            co -= origin
+
+        mesh.vertices.foreach_set("co", co.astype(np.float32).ravel())
+        mesh.update()
+        ob.matrix_basis = Matrix()
+
+    bpy.context.view_layer.update()
+
+@profiling.timed("normals")
+def clear_custom_split_normals(objects, activate= True, sharp_angle= None):
+    """Clear custom split normals of the meshes of objects
+
+    Works on the mesh data, without context, every mesh is cleared once.
+    With sharp_angle the meshes are smooth shaded and the edges above the
+    angle are marked sharp.
+    """
+    if not activate:
+        return
+    meshes = {ob.data for ob in objects if ob.type == 'MESH'}
+    for mesh in meshes:
+        if "custom_normal" in mesh.attributes:
+            # custom normals are a generic attribute since Blender 5.0
+            mesh.attributes.remove(mesh.attributes["custom_normal"])
+        elif mesh.has_custom_normals:
+            # zero vectors reset the custom normals to the default ones
+            mesh.normals_split_custom_set_from_vertices(np.zeros((len(mesh.vertices), 3), dtype= np.float32))
+
+        if sharp_angle is not None:
+            if hasattr(mesh, "set_sharp_from_angle"):
+                mesh.set_sharp_from_angle(angle= sharp_angle)
+            else:
+                mesh.polygons.foreach_set("use_smooth", np.ones(len(mesh.polygons), dtype= bool))
+                mesh.use_auto_smooth = True
+                mesh.auto_smooth_angle = sharp_angle
+        mesh.update()
+    print (f"Custom split normals cleared on {len(meshes)} meshes")
 
 def obj_export_path():
     """Determine the OBJ export path"""
@@ -525,30 +1039,50 @@ def deselect_all():
     """Deselect all"""
     for ob in bpy.context.selected_objects:
         ob.select_set(False)
-    print ("deselect all!")
 
-def export_to_obj(item, directory):
-    """Export item to obj, item could be a single object or a collection of objects"""
-    deselect_all()
+def export_selected_obj(filepath):
+    """Export the selected objects with the Blender OBJ exporter"""
+    if "obj" in dir(bpy.ops.export_scene):
+        bpy.ops.export_scene.obj(filepath= filepath, check_existing= False, use_selection= True)
+    else:
+        # the python exporter was removed, use the C++ one
+        bpy.ops.wm.obj_export(filepath= filepath, check_existing= False, export_selected_objects= True)
+
+def export_to_obj(item, directory, emitter= None):
+    """Export item to obj, item could be a single object or a collection of objects
+
+    With the built-in writer the file is written by emitter when given.
+    """
+    props = get_props()
     filepath = os.path.join(directory, f"{item.name}.obj")
 
-    # select object to export
     if hasattr(item, 'type'):
         # if the item is a mesh object
-        if item.type == 'MESH':
-            item.select_set(True)
-            bpy.ops.export_scene.obj(filepath= filepath, check_existing= False, use_selection= True)
-            deselect_all()
+        export_objects = [item] if item.type == 'MESH' else []
     elif hasattr(item, 'objects'):
         # if the item is a collection
         export_objects = [ob for ob in item.objects if ob.type == 'MESH']
-        if export_objects:
-            for ob in export_objects:
-                ob.select_set(True)
-            bpy.ops.export_scene.obj(filepath= filepath, check_existing= False, use_selection= True)
-            deselect_all()
     else:
         print(f"{item.name} is not a mesh or a collection, export aborted")
+        return
+
+    if not export_objects:
+        return
+
+    if props.obj_writer == 'BUILTIN':
+        export = objio.snapshot_obj(filepath, export_objects, bpy.context.evaluated_depsgraph_get())
+        if emitter:
+            emitter.submit(export)
+        else:
+            objio.write_obj_export(export)
+        return
+
+    # select objects to export
+    deselect_all()
+    for ob in export_objects:
+        ob.select_set(True)
+    export_selected_obj(filepath)
+    deselect_all()
 
 def load_decal_mat(blend_file, material_name):
     '''Get the dacal material from the decal template blend file'''
@@ -568,9 +1102,34 @@ def load_decal_mod(blend_file, object_name):
         except:
             print("Cannot find Batch DECAL object template")
 
-def add_modifiers(ob, modifiers: list):
+# size of an image pixel on the decal planes
+DECAL_PIXEL_SIZE = 0.001
+
+# the subdivision doesn't make faces smaller than this many pixels
+MIN_SUBSURF_PIXELS = 16
+
+def get_subsurf_levels(image_size, outline= None, edge_length= 0.064, max_levels= 3):
+    """Get the subdivision levels of a decal from its size
+
+    The plane is subdivided until its faces are about edge_length long,
+    but not below MIN_SUBSURF_PIXELS pixels of the image.
+    """
+    uvs = DECAL_PLANE_UVS if outline is None else outline
+    pixels = float(((uvs.max(axis= 0) - uvs.min(axis= 0)) * image_size).max())
+    if pixels <= 0.0 or edge_length <= 0.0:
+        return max_levels
+    levels = min(
+        math.ceil(math.log2(max(pixels * DECAL_PIXEL_SIZE / edge_length, 1.0))),
+        math.floor(math.log2(max(pixels / MIN_SUBSURF_PIXELS, 1.0))))
+    return max(0, min(levels, max_levels))
+
+@profiling.timed("decal_modifiers")
+def add_modifiers(ob, modifiers: list, subsurf_levels= 3):
     """Add all modifiers in the list to the object"""
     for mod in modifiers:
+        if mod.type == 'SUBSURF' and subsurf_levels == 0:
+            # nothing to subdivide on small decals
+            continue
         ob.modifiers.new(name= mod.name, type= mod.type)
         mod = ob.modifiers.get(mod.name)
         if mod.type == 'DISPLACE':
@@ -578,8 +1137,8 @@ def add_modifiers(ob, modifiers: list):
             mod.mid_level = 0.995
         if mod.type == 'SUBSURF':
             mod.subdivision_type = 'SIMPLE'
-            mod.render_levels = 3
-            mod.levels = 3
+            mod.render_levels = subsurf_levels
+            mod.levels = subsurf_levels
             mod.quality = 3
         if mod.type == 'SHRINKWRAP':
             mod.wrap_method = 'PROJECT'
@@ -589,6 +1148,38 @@ def add_modifiers(ob, modifiers: list):
             mod.use_positive_direction = True
             mod.offset = 0.012
 
+@profiling.timed("decal_bake")
+def bake_modifiers(ob):
+    """Apply the modifiers ahead of the first shrinkwrap to the mesh
+
+    The shrinkwrap target is only known once the insert is placed, so the
+    shrinkwrap and the modifiers after it stay live.
+    """
+    baked = []
+    for mod in ob.modifiers:
+        if mod.type == 'SHRINKWRAP':
+            break
+        baked.append(mod)
+    if not baked:
+        return
+
+    # evaluate the object with the baked modifiers only
+    live = [mod for mod in ob.modifiers if mod not in baked and mod.show_viewport]
+    for mod in live:
+        mod.show_viewport = False
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    mesh = bpy.data.meshes.new_from_object(ob.evaluated_get(depsgraph), preserve_all_data_layers= True, depsgraph= depsgraph)
+    for mod in live:
+        mod.show_viewport = True
+
+    old_mesh = ob.data
+    ob.data = mesh
+    for mod in baked:
+        ob.modifiers.remove(mod)
+    name = old_mesh.name
+    bpy.data.meshes.remove(old_mesh)
+    mesh.name = name
+
 def get_pngs(images_folder):
     '''Get a list of all the PNGs in the folder'''
     pngs_folder = bpy.path.abspath(images_folder)
@@ -596,6 +1187,52 @@ def get_pngs(images_folder):
     pngs = [f for f in os.listdir(real_path) if f[-3:].lower()=="png"]
     return pngs
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def read_png_info(path):
+    """Read the size, bit depth and alpha of a PNG from its chunk headers
+
+    The pixels are not decoded, only the IHDR chunk is read and the chunk
+    headers are walked until the image data to find a tRNS chunk.
+    Returns None when the file is not a PNG or its header is truncated.
+    """
+    with open(path, 'rb') as png:
+        if png.read(8) != PNG_SIGNATURE:
+            return None
+        header = png.read(8)
+        if len(header) < 8:
+            return None
+        length, kind = struct.unpack(">I4s", header)
+        if kind != b"IHDR" or length < 13:
+            return None
+        ihdr = png.read(10)
+        if len(ihdr) < 10:
+            return None
+        width, height, bit_depth, color_type = struct.unpack(">IIBB", ihdr)
+        if not width or not height:
+            return None
+        info = {
+            "width": width,
+            "height": height,
+            "bit_depth": bit_depth,
+            "color_type": color_type,
+            # grayscale alpha and RGBA
+            "alpha": color_type in (4, 6),
+        }
+
+        png.seek(length - 10 + 4, os.SEEK_CUR)
+        while not info["alpha"]:
+            header = png.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            if kind in (b"IDAT", b"IEND"):
+                break
+            if kind == b"tRNS":
+                info["alpha"] = True
+            png.seek(length + 4, os.SEEK_CUR)
+    return info
+
 def unwrap_obj(obj):
     '''UV Unwrap the object'''
     # This can be improved in the future by using bmesh instead
@@ -610,8 +1247,9 @@ def unwrap_obj(obj):
     bpy.ops.object.mode_set(mode='OBJECT')
 
 def assign_image(image, material):
-    '''Assign image to material'''
-    image = bpy.data.images.get(image)
+    '''Assign image to material, by image datablock or name'''
+    if isinstance(image, str):
+        image = bpy.data.images.get(image)
     image_node = material.node_tree.nodes['decal']
 
     if not image_node is None:    
@@ -619,58 +1257,68 @@ def assign_image(image, material):
     else:
         print("The given material doesn't have a decal node!")
 
-def create_decal(image_name, image_size, decal_mat_name):
-    '''Create a new mesh plane object with the same image name and aspect ratio'''
-    size_x = image_size[0] / 1000
-    size_y = image_size[1] / 1000
-    name = image_name[:-4]
-
-    # # create a new mesh
-    # bm = bmesh.new()
-    # v1 = bm.verts.new((size_x/2, size_y/2, 0))
-    # v2 = bm.verts.new((-size_x/2, size_y/2, 0))
-    # v3 = bm.verts.new((-size_x/2, -size_y/2, 0))
-    # v4 = bm.verts.new((size_x/2, -size_y/2, 0))
-    # verts = [v1, v2, v3, v4]
-
-    # bm.faces.new(verts)
-
-    # mesh = bpy.data.meshes.new(name)
-    # bm.to_mesh(mesh)
-    # bm.free()
-
-    # # create a new object
-    # ob = bpy.data.objects.new(name, mesh)
+# decals created at once by the decal batch
+DECAL_BATCH_SIZE = 100
+
+# corners of the unit decal plane, counter-clockwise seen from +Z
+DECAL_PLANE_UVS = np.array(((0, 0), (1, 0), (1, 1), (0, 1)), dtype= np.float32)
+
+def create_decal_mesh(name, image_size, outline= None):
+    """Create a single face mesh centered on the origin
+
+    The outline holds the corners in the UV space of the image, counter-clockwise,
+    the whole image when None. The mesh is sized from the image pixels.
+    """
+    uvs = DECAL_PLANE_UVS if outline is None else np.asarray(outline, dtype= np.float32)
+    corners = len(uvs)
+    center = (uvs.min(axis= 0) + uvs.max(axis= 0)) / 2
+    co = np.zeros((corners, 3), dtype= np.float32)
+    co[:, :2] = (uvs - center) * image_size * DECAL_PIXEL_SIZE
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(corners)
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.loops.add(corners)
+    mesh.loops.foreach_set("vertex_index", np.arange(corners, dtype= np.int32))
+    mesh.polygons.add(1)
+    mesh.polygons.foreach_set("loop_start", np.zeros(1, dtype= np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", np.full(1, corners, dtype= np.int32))
+    mesh.uv_layers.new(name= "UVMap").data.foreach_set("uv", uvs.ravel())
+    mesh.update(calc_edges= True)
+    return mesh
+
+@profiling.timed("decal")
+def create_decals(decals, decal_mat_name, collection= None):
+    """Create the decal planes of a list of (image name, image size, image, outline)
+
+    The meshes are built from data and linked to collection without
+    operators, the plane sizes follow the image sizes.
+    """
+    if collection is None:
+        collection = bpy.context.collection
 
-    # # link the object to the scene collection
-    # bpy.context.collection.objects.link(ob)
-    # bpy.context.view_layer.objects.active = ob
-
-    bpy.ops.mesh.primitive_plane_add('INVOKE_REGION_WIN')
-    plane = bpy.context.active_object
-
-    if plane.mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode='OBJECT')
-    plane.dimensions = size_x, size_y, 0.0
-    plane.data.name = plane.name = name
-    bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
-
-
-    # create a new material
     decal_template_mat = bpy.data.materials.get(decal_mat_name)
-    if not decal_template_mat is None:
-        mat = decal_template_mat.copy()
-        mat.name = name
-        assign_image(image_name, mat)
-
-        # assign the new material to object
-        plane.data.materials.append(mat)
-    else:
+    if decal_template_mat is None:
         print("Decal template material was not imported correctly")
 
-    # unwrap
-    # unwrap_obj(ob)
-    return plane
+    objects = []
+    for image_name, image_size, image, outline in decals:
+        name = image_name[:-4]
+        mesh = create_decal_mesh(name, image_size, outline)
+        ob = bpy.data.objects.new(name, mesh)
+        objects.append(ob)
+
+        if decal_template_mat is not None:
+            # create a new material
+            mat = decal_template_mat.copy()
+            mat.name = name
+            assign_image(image or image_name, mat)
+            mesh.materials.append(mat)
+
+    for ob in objects:
+        collection.objects.link(ob)
+    return objects
 
 
 